@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+
+import click
+
+# Files optimized by a batch are named `{stem}{SUFFIX}.json` by default, and
+# skipped when walking directories.
+SUFFIX = ".opt"
+
+
+def find_inputs(paths, suffix=SUFFIX):
+    """
+    Programs to optimize, as (input path, output path relative to the output
+    directory). `paths` are files, directories, searched recursively for
+    `*.json` files, or glob patterns. The output paths keep the layout under
+    a directory, or under the part of a pattern before its first wildcard.
+    """
+    from glob import glob, has_magic
+    import os
+
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".json") and not name.endswith(f"{suffix}.json"):
+                        full = os.path.join(root, name)
+                        inputs.append((full, os.path.relpath(full, path)))
+        elif os.path.isfile(path):
+            inputs.append((path, os.path.basename(path)))
+        else:
+            matches = sorted(glob(path, recursive=True))
+            if not matches:
+                raise click.BadParameter(
+                    f"No such file or pattern: {path}.", param_hint="PATHS"
+                )
+            parts = path.split(os.sep)
+            fixed = next(i for i, part in enumerate(parts) if has_magic(part))
+            root = os.sep.join(parts[:fixed]) or os.curdir
+            inputs += [
+                (match, os.path.relpath(match, root))
+                for match in matches
+                if os.path.isfile(match) and not match.endswith(f"{suffix}.json")
+            ]
+    return inputs
+
+
+def output_path(src, rel, out_dir=None, suffix=SUFFIX):
+    import os
+
+    stem, ext = os.path.splitext(rel if out_dir is not None else src)
+    path = f"{stem}{suffix}{ext}"
+    return path if out_dir is None else os.path.join(out_dir, path)
+
+
+def opt_file(src, dest, passes):
+    """
+    Optimizes the program in the file `src` with `passes`, writing it to
+    `dest` in the same form (JSON or binary, see `binfmt`). Returns a record
+    of the run, whose "error" is set if it failed.
+    """
+    from time import perf_counter
+    import json
+    import os
+    from binfmt import MAGIC, is_binary, read_prg, write_prg
+    from opt import opt_prg
+    from stats import count_instrs
+
+    record = dict(path=src, functions=0, instrs_before=0, instrs_after=0, error=None)
+    start = perf_counter()
+    try:
+        with open(src, "rb") as f:
+            binary = is_binary(f.read(len(MAGIC)))
+            f.seek(0)
+            prg = read_prg(f) if binary else json.load(f)
+            prg["functions"] = list(prg["functions"])
+        record["functions"] = len(prg["functions"])
+        record["instrs_before"] = sum(count_instrs(fn) for fn in prg["functions"])
+        prg = opt_prg(prg, passes)
+        record["instrs_after"] = sum(count_instrs(fn) for fn in prg["functions"])
+        if os.path.dirname(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb" if binary else "w") as f:
+            if binary:
+                write_prg(prg, f)
+            else:
+                json.dump(prg, f)
+                f.write("\n")
+    except Exception as e:
+        # A bad program must not stop the batch.
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["time"] = perf_counter() - start
+    return record
+
+
+def opt_files(todo, passes, jobs=1):
+    """
+    Yields the record of `opt_file` for each (input, output) of
+    `todo`, in order, over a pool of `jobs` processes.
+    """
+    from functools import partial
+    from itertools import repeat
+
+    if not todo:
+        return
+    if jobs <= 1:
+        yield from map(partial(opt_file, passes=passes), *zip(*todo))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Small programs are sent a few at a time to the workers.
+    chunksize = max(1, min(64, len(todo) // (4 * jobs)))
+    with ProcessPoolExecutor(jobs) as pool:
+        srcs, dests = zip(*todo)
+        yield from pool.map(opt_file, srcs, dests, repeat(passes), chunksize=chunksize)
+
+
+def summarize(records, time):
+    ok = [record for record in records if record["error"] is None]
+    instrs = sum(record["instrs_before"] for record in ok)
+    return dict(
+        programs=len(records),
+        failed=len(records) - len(ok),
+        functions=sum(record["functions"] for record in ok),
+        instrs_before=instrs,
+        instrs_after=sum(record["instrs_after"] for record in ok),
+        time=time,
+        programs_per_s=len(ok) / time if time > 0 else 0.0,
+        instrs_per_s=instrs / time if time > 0 else 0.0,
+        failures={
+            record["path"]: record["error"] for record in records if record["error"]
+        },
+    )
+
+
+@click.command()
+@click.argument("paths", nargs=-1, required=True)
+@click.option(
+    "--passes",
+    required=True,
+    help="Comma-separated passes to run in order (see `opt.py`).",
+)
+@click.option(
+    "--out-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Write the optimized programs here instead of next to the inputs, "
+    "keeping the layout of the input directories.",
+)
+@click.option(
+    "--suffix",
+    default=SUFFIX,
+    show_default=True,
+    help="Added to the names of the optimized programs.",
+)
+@click.option("--jobs", default=1, help="Processes optimizing programs in parallel.")
+@click.option(
+    "--stats-file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Also write the summary and the record of every program as JSON to this file.",
+)
+def main(paths, passes, out_dir, suffix, jobs, stats_file):
+    """
+    Optimizes every program in PATHS (files, directories of `*.json`
+    files, or glob patterns), reporting the throughput and the programs that
+    could not be optimized. Exits with status 1 if any failed.
+    """
+    from time import perf_counter
+    import json
+    import os
+    import sys
+    from opt import parse_passes
+
+    try:
+        passes = parse_passes(passes)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--passes")
+    inputs = find_inputs(paths, suffix)
+    todo, srcs = [], dict()
+    for src, rel in inputs:
+        dest = output_path(src, rel, out_dir, suffix)
+        if dest in srcs and os.path.samefile(srcs[dest], src):
+            continue
+        if dest in srcs:
+            raise click.UsageError(
+                f"{srcs[dest]} and {src} would both be optimized to {dest}."
+            )
+        srcs[dest] = src
+        todo.append((src, dest))
+    start = perf_counter()
+    records = []
+    for record in opt_files(todo, passes, jobs):
+        records.append(record)
+        if record["error"] is not None:
+            print(f"{record['path']}: {record['error']}", file=sys.stderr)
+    summary = summarize(records, perf_counter() - start)
+    done = summary["programs"] - summary["failed"]
+    print(
+        f"Optimized {done}/{summary['programs']} programs"
+        f" ({summary['instrs_before']} instructions) in {summary['time']:.2f}s:"
+        f" {summary['programs_per_s']:.1f} programs/s,"
+        f" {summary['instrs_per_s']:.0f} instructions/s.",
+        file=sys.stderr,
+    )
+    if stats_file is not None:
+        with open(stats_file, "w") as f:
+            json.dump(dict(summary, records=records), f)
+            f.write("\n")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
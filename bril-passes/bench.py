@@ -0,0 +1,297 @@
+#! /usr/bin/env python3
+
+import click
+from opt import PASSES
+
+# Benchmarked passes: `form_cfg` alone, then every pass of `opt.PASSES`.
+BENCH_PASSES = ("form_cfg", *PASSES)
+# Generator parameters that can be scaled.
+PARAMS = ("functions", "blocks", "block_len", "redef", "consts")
+INT_OPS = ("add", "mul", "sub")
+
+
+def gen_redef_block(ninstrs, nvars):
+    """
+    Straight-line block of `ninstrs` instructions cycling over `nvars`
+    variables, so that every variable is redefined `ninstrs / nvars` times.
+    """
+    body = [dict(op="const", dest=f"v{i}", type="int", value=i) for i in range(nvars)]
+    for i in range(nvars, ninstrs):
+        body.append(
+            dict(
+                op="add" if i % 2 else "mul",
+                dest=f"v{i % nvars}",
+                type="int",
+                args=[f"v{(i - 1) % nvars}", f"v{(i - 2) % nvars}"],
+            )
+        )
+    body.append(dict(op="print", args=[f"v{i}" for i in range(nvars)]))
+    return body
+
+
+def gen_dead_chain(ninstrs):
+    """
+    Chain of `ninstrs` definitions, each one only used by the next, with the
+    last one never used.
+    """
+    body = [dict(op="const", dest="v0", type="int", value=1)]
+    for i in range(1, ninstrs):
+        body.append(dict(op="add", dest=f"v{i}", type="int", args=[f"v{i - 1}", "v0"]))
+    return body
+
+
+def gen_fn(name, blocks, block_len, redef, consts, rng):
+    """
+    Synthetic function of `blocks` labelled blocks of `block_len`
+    instructions each. Every instruction is a constant with probability
+    `consts` and an integer operation on two earlier variables otherwise.
+    Its destination is an existing variable with probability `redef` and a
+    new one otherwise. Blocks end with a branch to one of the next two
+    blocks, the last one prints a few variables. Operations only read
+    variables defined in the first block or earlier in their own block, so
+    the function runs whatever branches are taken.
+    """
+    instrs = [dict(op="const", dest="v0", type="int", value=1)]
+    nvars = 1
+    entry = ["v0"]
+    for b in range(blocks):
+        instrs.append(dict(label=f"b{b}"))
+        avail = entry if b == 0 else list(entry)
+        for _ in range(block_len):
+            if nvars > 1 and rng.random() < redef:
+                dest = f"v{rng.randrange(nvars)}"
+            else:
+                dest = f"v{nvars}"
+                nvars += 1
+            if rng.random() < consts:
+                instr = dict(op="const", dest=dest, type="int", value=rng.randrange(8))
+            else:
+                args = [rng.choice(avail) for _ in range(2)]
+                instr = dict(op=rng.choice(INT_OPS), dest=dest, type="int", args=args)
+            instrs.append(instr)
+            avail.append(dest)
+        if b + 1 < blocks:
+            instrs.append(
+                dict(op="lt", dest="cond", type="bool", args=["v0", avail[-1]])
+            )
+            succs = [f"b{b + 1}", f"b{min(b + 2, blocks - 1)}"]
+            instrs.append(dict(op="br", args=["cond"], labels=succs))
+    instrs.append(dict(op="print", args=entry[:8]))
+    return dict(name=name, instrs=instrs)
+
+
+def gen_prg(functions=1, blocks=1, block_len=1000, redef=0.5, consts=0.3, seed=0):
+    from random import Random
+
+    rng = Random(seed)
+    fns = [
+        gen_fn(f"f{i}", blocks, block_len, redef, consts, rng) for i in range(functions)
+    ]
+    return dict(functions=fns)
+
+
+def count_instrs(prg):
+    return sum(
+        1 for fn in prg["functions"] for instr in fn["instrs"] if "label" not in instr
+    )
+
+
+def run_pass(name, prg):
+    if name == "form_cfg":
+        from cfg import form_cfg
+
+        for fn in prg["functions"]:
+            form_cfg(fn["instrs"], 0)
+        return prg
+
+    from opt import opt_prg
+
+    return opt_prg(prg, [name])
+
+
+def warm_up(name):
+    """
+    Runs a pass once on a tiny program, so that the modules it imports
+    lazily are loaded before it is timed.
+    """
+    run_pass(name, gen_prg(blocks=2, block_len=10))
+    return
+
+
+def bench_pass(name, prg, memory=True):
+    """
+    Runs a pass in-process on a copy of `prg`, after warming it up (see
+    `warm_up`). Returns the time, the peak of memory allocated while it ran
+    (a second run, as tracing slows Python down) and the number of
+    instructions it removed.
+    """
+    from copy import deepcopy
+    from time import perf_counter
+
+    warm_up(name)
+    before = count_instrs(prg)
+    new_prg = deepcopy(prg)
+    start = perf_counter()
+    new_prg = run_pass(name, new_prg)
+    elapsed = perf_counter() - start
+    result = dict(
+        time=elapsed,
+        instrs_before=before,
+        instrs_after=count_instrs(new_prg),
+        instrs_removed=before - count_instrs(new_prg),
+    )
+    if memory:
+        import tracemalloc
+
+        new_prg = deepcopy(prg)
+        tracemalloc.start()
+        run_pass(name, new_prg)
+        result["peak_mem"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def bench_passes(passes, scale, values, memory=True, **params):
+    results = []
+    for value in values:
+        if scale is not None:
+            params[scale] = value
+        prg = gen_prg(**params)
+        for name in passes:
+            results.append(dict(params, name=name, **bench_pass(name, prg, memory)))
+    return results
+
+
+def bench_dce(blocks, **params):
+    """
+    Global dead code elimination from liveness against the fixpoint of dead
+    and killed definitions, on programs with more and more blocks.
+    """
+    results = []
+    for nblocks in blocks:
+        prg = gen_prg(blocks=nblocks, **params)
+        result = dict(params, blocks=nblocks)
+        for name in ("tdce", "tdce-live-defs"):
+            result[name] = bench_pass(name, prg, memory=False)
+        results.append(result)
+    return results
+
+
+def bench_lvn(sizes, nvars):
+    from time import perf_counter
+    from lvn import lvn_block
+
+    results = []
+    for size in sizes:
+        body = gen_redef_block(size, nvars)
+        start = perf_counter()
+        lvn_block(body)
+        elapsed = perf_counter() - start
+        results.append(
+            dict(ninstrs=size, time=elapsed, us_per_instr=1e6 * elapsed / size)
+        )
+    return results
+
+
+def bench_dead_defs(sizes):
+    from time import perf_counter
+    from tdce import dead_defs_pass
+
+    results = []
+    for size in sizes:
+        body = gen_dead_chain(size)
+        start = perf_counter()
+        dead_defs_pass(body)
+        elapsed = perf_counter() - start
+        results.append(
+            dict(ninstrs=size, time=elapsed, us_per_instr=1e6 * elapsed / size)
+        )
+    return results
+
+
+@click.group()
+def main():
+    return
+
+
+@main.command()
+@click.option("--max-size", default=100_000, help="Largest block size.")
+@click.option("--steps", default=4, help="Number of halvings of the block size.")
+@click.option("--nvars", default=16, help="Variables redefined over the block.")
+def micro(max_size, steps, nvars):
+    """
+    Scaling of LVN renaming and dead definitions on single blocks.
+    """
+    import json
+
+    sizes = [max_size >> i for i in reversed(range(steps))]
+    # Both passes are linear in the block length: the time per instruction
+    # should stay flat as the block grows.
+    results = dict(lvn=bench_lvn(sizes, nvars), dead_defs=bench_dead_defs(sizes))
+    print(json.dumps(results, indent=2))
+    return
+
+
+@main.command()
+@click.option("--functions", default=1, help="Functions per program.")
+@click.option("--blocks", default=1, help="Basic blocks per function.")
+@click.option("--block-len", default=1000, help="Instructions per block.")
+@click.option("--redef", default=0.5, help="Probability of redefining a variable.")
+@click.option("--consts", default=0.3, help="Probability of a constant.")
+@click.option("--seed", default=0)
+@click.option(
+    "--passes",
+    default=",".join(BENCH_PASSES),
+    help=f"Comma-separated passes to benchmark, among: {', '.join(BENCH_PASSES)}.",
+)
+@click.option(
+    "--scale",
+    type=click.Choice(PARAMS),
+    default=None,
+    help="Parameter doubled at each step, to get scaling curves.",
+)
+@click.option("--steps", default=4, help="Number of values of the scaled parameter.")
+@click.option("--no-memory", is_flag=True, help="Skip the peak memory measurement.")
+@click.option("--output", type=click.File("w"), default="-")
+def passes(scale, steps, passes, no_memory, output, **params):
+    """
+    Time, peak memory and instructions removed by each pass on synthetic
+    programs, as JSON.
+    """
+    import json
+
+    passes = [name.strip() for name in passes.split(",") if name.strip()]
+    for name in passes:
+        if name not in BENCH_PASSES:
+            raise click.BadParameter(f"Unknown pass: {name}.", param_hint="--passes")
+    values = [None]
+    if scale is not None:
+        values = [params[scale] * 2**i for i in range(steps)]
+        if scale in ("redef", "consts"):
+            values = [min(v, 1.0) for v in values]
+    results = bench_passes(passes, scale, values, memory=not no_memory, **params)
+    json.dump(results, output, indent=2)
+    output.write("\n")
+    return
+
+
+@main.command()
+@click.option("--max-blocks", default=512, help="Largest number of blocks.")
+@click.option("--steps", default=4, help="Number of halvings of the number of blocks.")
+@click.option("--block-len", default=50, help="Instructions per block.")
+@click.option("--redef", default=0.5, help="Probability of redefining a variable.")
+@click.option("--seed", default=0)
+def dce(max_blocks, steps, **params):
+    """
+    Liveness-driven DCE (tdce-live-defs) against the dead and killed
+    definitions fixpoint (tdce) on branchy programs.
+    """
+    import json
+
+    blocks = [max_blocks >> i for i in reversed(range(steps))]
+    print(json.dumps(bench_dce(blocks, **params), indent=2))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+#! /usr/bin/env python3
+
+"""
+Binary form of `bril` programs, for pipelines between the tools of this
+directory. Opcodes, variables, labels, types and constants are stored once
+in a string table, functions are arrays of 32-bit little-endian integers,
+and an index gives the offset of every function, so that a program is read
+one function at a time, through `mmap` when it is a file.
+
+    header:    MAGIC, version (u16), 0 (u16)
+    functions: one record per function (see `encode_fn`)
+    strings:   offsets (u64, one more than strings), then the UTF-8 bytes
+    index:     offset, number of words and name of every function (u64)
+    footer:    offsets and sizes of the strings and the index, and the
+               string holding the JSON of the program without its functions
+               (see `FOOTER`)
+
+A record starts with the shape of the object: its keys, in order. Known
+keys are coded as string numbers (`name`, `label`, `op`, `dest`, `type`,
+`value`), counted lists of them (`args`, `funcs`, `labels`) or nested
+records (`instrs`). Other keys, and values that are not of the expected
+form, are marked with a leading `=` in the shape and stored as JSON text,
+so that any program is converted back to the same JSON.
+"""
+
+import click
+import struct
+import sys
+from array import array
+
+MAGIC = b"BRLB"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+# Strings offset, strings count, index offset, functions count, program string.
+FOOTER = struct.Struct("<QQQQQ")
+# Keys coded as a string, as a list of strings, or as a type.
+STR_KEYS = ("name", "label", "op", "dest")
+LIST_KEYS = ("args", "funcs", "labels")
+RAW = "="
+# Codings of the values of an instruction.
+NAME, NAMES, TYPE, JSON = "name", "names", "type", "json"
+
+
+def is_binary(head):
+    return head[: len(MAGIC)] == MAGIC
+
+
+def type_to_str(type_):
+    """
+    Text of a type (e.g. `ptr<int>`), or `None` if it cannot be coded.
+    """
+    if isinstance(type_, str):
+        return type_ if "<" not in type_ else None
+    if isinstance(type_, dict) and len(type_) == 1:
+        ((ptr, inner),) = type_.items()
+        inner = type_to_str(inner)
+        return None if inner is None or not isinstance(ptr, str) else f"{ptr}<{inner}>"
+    return None
+
+
+def str_to_type(text):
+    if not text.endswith(">"):
+        return text
+    ptr, inner = text[:-1].split("<", 1)
+    return {ptr: str_to_type(inner)}
+
+
+def is_names(val):
+    return isinstance(val, list) and all(isinstance(x, str) for x in val)
+
+
+def is_fn_args(val):
+    return isinstance(val, list) and all(
+        isinstance(arg, dict)
+        and list(arg) == ["name", "type"]
+        and isinstance(arg["name"], str)
+        and type_to_str(arg["type"]) is not None
+        for arg in val
+    )
+
+
+class Strings:
+    """
+    String table being written: every string gets the number of its first
+    occurrence.
+    """
+
+    def __init__(self):
+        self.index: dict = dict()
+        self.strings: list = []
+        return
+
+    def __call__(self, string):
+        sid = self.index.get(string, None)
+        if sid is None:
+            sid = self.index[string] = len(self.strings)
+            self.strings.append(string)
+        return sid
+
+    def to_bytes(self):
+        blobs = [string.encode() for string in self.strings]
+        offsets = array("Q", [0])
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        return to_le(offsets).tobytes() + b"".join(blobs)
+
+
+def to_le(words):
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+def encode_obj(obj, sid, words, coders):
+    """
+    Appends the record of `obj` to `words`, with `coders` giving, for each
+    key, whether its value can be coded and how.
+    """
+    import json
+
+    shape = []
+    body = []
+    for key, val in obj.items():
+        coder = coders.get(key, None)
+        if coder is None or not coder[0](val):
+            shape.append(RAW + key)
+            body.append(sid(json.dumps(val)))
+            continue
+        shape.append(key)
+        coder[1](val, body)
+    words.append(sid("\0".join(shape)))
+    words += body
+    return
+
+
+def encode_fn(fn, sid):
+    """
+    Record of a function as a list of words, string numbers coming from
+    `sid`.
+    """
+    import json
+
+    def encode_names(val, words):
+        words.append(len(val))
+        words += [sid(x) for x in val]
+
+    def encode_args(val, words):
+        words.append(len(val))
+        for arg in val:
+            words += (sid(arg["name"]), sid(type_to_str(arg["type"])))
+
+    def encode_instrs(val, words):
+        words.append(len(val))
+        for instr in val:
+            encode_obj(instr, sid, words, instr_coders)
+
+    str_coder = (
+        lambda val: isinstance(val, str),
+        lambda val, words: words.append(sid(val)),
+    )
+    type_coder = (
+        lambda val: type_to_str(val) is not None,
+        lambda val, words: words.append(sid(type_to_str(val))),
+    )
+    instr_coders = dict(
+        **{key: str_coder for key in STR_KEYS},
+        **{key: (is_names, encode_names) for key in LIST_KEYS},
+        type=type_coder,
+        value=(lambda val: True, lambda val, words: words.append(sid(json.dumps(val)))),
+    )
+    fn_coders = dict(
+        name=str_coder,
+        type=type_coder,
+        args=(is_fn_args, encode_args),
+        instrs=(
+            lambda val: isinstance(val, list) and all(isinstance(x, dict) for x in val),
+            encode_instrs,
+        ),
+    )
+    words = []
+    encode_obj(fn, sid, words, fn_coders)
+    return words
+
+
+def write_prg(prg, file):
+    """
+    Writes `prg` in binary to the binary file `file`. The functions are
+    written as they are taken from `prg["functions"]`, which can be any
+    iterable, and only the string table is kept until the end.
+    """
+    import json
+
+    sid = Strings()
+    meta = {key: (None if key == "functions" else val) for key, val in prg.items()}
+    file.write(HEADER.pack(MAGIC, VERSION, 0))
+    offset = HEADER.size
+    index = array("Q")
+    for fn in prg.get("functions", []):
+        words = to_le(array("I", encode_fn(fn, sid)))
+        file.write(words.tobytes())
+        index += array("Q", (offset, len(words), sid(fn.get("name", ""))))
+        offset += len(words) * words.itemsize
+    meta_sid = sid(json.dumps(meta))
+    strings = sid.to_bytes()
+    file.write(strings)
+    file.write(to_le(index).tobytes())
+    nfns = len(index) // 3
+    file.write(
+        FOOTER.pack(offset, len(sid.strings), offset + len(strings), nfns, meta_sid)
+    )
+    return
+
+
+class BinPrg:
+    """
+    Program read from the binary form in `buf` (`bytes` or `mmap`). Strings
+    are decoded the first time they are used, and functions every time
+    they are asked for (see `BinFns`).
+    """
+
+    def __init__(self, buf):
+        magic, version, _ = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a binary bril program (version {VERSION}).")
+        self.buf = buf
+        strings_off, nstrings, index_off, nfns, meta_sid = FOOTER.unpack_from(
+            buf, len(buf) - FOOTER.size
+        )
+        self.offsets: array = self.read_array("Q", strings_off, nstrings + 1)
+        self.blob_off: int = strings_off + self.offsets.itemsize * (nstrings + 1)
+        self.index: array = self.read_array("Q", index_off, 3 * nfns)
+        # Decoded strings, `None` until used.
+        self.strings: list = [None] * nstrings
+        # Shapes as tuples of (key, is raw), and values and types, by string.
+        self.shapes: dict = dict()
+        self.instr_shapes: dict = dict()
+        self.values: dict = dict()
+        self.types: dict = dict()
+        self.meta_sid: int = meta_sid
+        return
+
+    def read_array(self, code, offset, n):
+        words = array(code)
+        words.frombytes(self.buf[offset : offset + n * words.itemsize])
+        return to_le(words)
+
+    def string(self, sid):
+        string = self.strings[sid]
+        if string is None:
+            start = self.blob_off + self.offsets[sid]
+            end = self.blob_off + self.offsets[sid + 1]
+            string = self.strings[sid] = sys.intern(bytes(self.buf[start:end]).decode())
+        return string
+
+    def json(self, sid):
+        import json
+
+        if sid in self.values:
+            return self.values[sid]
+        val = json.loads(self.string(sid))
+        # Only immutable values are shared between functions.
+        if val is None or isinstance(val, (bool, int, float, str)):
+            self.values[sid] = val
+        return val
+
+    def type(self, sid):
+        if sid in self.types:
+            return self.types[sid]
+        type_ = str_to_type(self.string(sid))
+        if isinstance(type_, str):
+            self.types[sid] = type_
+        return type_
+
+    def shape(self, sid):
+        if sid not in self.shapes:
+            keys = self.string(sid).split("\0") if self.string(sid) else []
+            self.shapes[sid] = tuple(
+                (key[1:], True) if key.startswith(RAW) else (key, False) for key in keys
+            )
+        return self.shapes[sid]
+
+    def __len__(self):
+        return len(self.index) // 3
+
+    def name(self, i):
+        return self.string(self.index[3 * i + 2])
+
+    def decode_fn(self, i):
+        words = self.read_array("I", self.index[3 * i], self.index[3 * i + 1])
+        fn, _ = self.decode_obj(words, 0, self.decode_fn_key)
+        return fn
+
+    def decode_obj(self, words, pos, decode_key):
+        obj = dict()
+        shape = self.shape(words[pos])
+        pos += 1
+        for key, raw in shape:
+            if raw:
+                obj[key] = self.json(words[pos])
+                pos += 1
+            else:
+                obj[key], pos = decode_key(key, words, pos)
+        return obj, pos
+
+    def decode_fn_key(self, key, words, pos):
+        if key == "name":
+            return self.string(words[pos]), pos + 1
+        if key == "type":
+            return self.type(words[pos]), pos + 1
+        n = words[pos]
+        pos += 1
+        if key == "args":
+            args = [
+                dict(name=self.string(words[j]), type=self.type(words[j + 1]))
+                for j in range(pos, pos + 2 * n, 2)
+            ]
+            return args, pos + 2 * n
+        return self.decode_instrs(words, pos, n)
+
+    def instr_shape(self, sid):
+        """
+        Shape of an instruction, as (key, coding of its value).
+        """
+        if sid not in self.instr_shapes:
+            codings = dict(type=TYPE, **{key: NAMES for key in LIST_KEYS})
+            self.instr_shapes[sid] = tuple(
+                (key, JSON if raw or key == "value" else codings.get(key, NAME))
+                for key, raw in self.shape(sid)
+            )
+        return self.instr_shapes[sid]
+
+    def decode_instrs(self, words, pos, n):
+        # Most of the decoding time is spent here, hence the local names and
+        # the inlined string lookups.
+        strings, string, instr_shape = self.strings, self.string, self.instr_shape
+        instrs = []
+        for _ in range(n):
+            instr = dict()
+            shape = instr_shape(words[pos])
+            pos += 1
+            for key, coding in shape:
+                if coding is NAME:
+                    val = strings[words[pos]]
+                    instr[key] = val if val is not None else string(words[pos])
+                    pos += 1
+                elif coding is NAMES:
+                    end = pos + 1 + words[pos]
+                    instr[key] = [
+                        strings[sid] if strings[sid] is not None else string(sid)
+                        for sid in words[pos + 1 : end]
+                    ]
+                    pos = end
+                elif coding is TYPE:
+                    instr[key] = self.type(words[pos])
+                    pos += 1
+                else:
+                    instr[key] = self.json(words[pos])
+                    pos += 1
+            instrs.append(instr)
+        return instrs, pos
+
+    def to_prg(self):
+        """
+        The program, with its functions decoded as they are used.
+        """
+        prg = self.json(self.meta_sid)
+        prg["functions"] = BinFns(self)
+        return prg
+
+
+class BinFns:
+    """
+    Functions of a `BinPrg`, as a read-only sequence. Each access decodes
+    the function again, so the functions are not kept in memory: a pass
+    keeping the functions it changes builds a list of them (as
+    `utils.map_prg` does).
+    """
+
+    def __init__(self, prg):
+        self.prg: BinPrg = prg
+        return
+
+    def __len__(self):
+        return len(self.prg)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.prg.decode_fn(i)
+
+    def __iter__(self):
+        return (self.prg.decode_fn(i) for i in range(len(self)))
+
+    def names(self):
+        return [self.prg.name(i) for i in range(len(self))]
+
+
+def read_prg(file):
+    """
+    Reads a program in binary from the binary file `file`, mapped in memory
+    if it is a regular file, read whole otherwise (e.g. a pipe).
+    """
+    import mmap
+    import os
+    import stat
+
+    try:
+        fd = file.fileno()
+        regular = stat.S_ISREG(os.fstat(fd).st_mode) and file.seek(0, os.SEEK_CUR) == 0
+    except (AttributeError, OSError):
+        regular = False
+    if regular:
+        buf = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    else:
+        buf = file.read()
+    return BinPrg(buf).to_prg()
+
+
+@click.command()
+@click.option("--to-json", is_flag=True, help="Convert from binary to JSON instead.")
+def main(to_json):
+    """
+    Converts a `bril` program from JSON to binary, or back.
+    """
+    from utils import load_prg, dump_prg
+
+    prg = load_prg()
+    prg["functions"] = list(prg["functions"])
+    dump_prg(prg, binary=not to_json)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+
+import click
+
+# Bumped whenever the passes change the code they emit, so that the functions
+# optimized by an older version are not reused.
+CACHE_VERSION = 1
+
+# Functions looked up at once, so that the misses of a batch are optimized
+# together (in parallel with `jobs`) while results are still streamed.
+BATCH_FNS = 64
+
+
+def fn_key(fn, salt):
+    """
+    Content hash of a function in its JSON form, with `salt` describing what
+    is done to it (the passes and their options).
+    """
+    from hashlib import sha256
+    import json
+
+    text = json.dumps(fn, sort_keys=True, separators=(",", ":"))
+    return sha256(f"{CACHE_VERSION}\0{salt}\0{text}".encode()).hexdigest()
+
+
+class FnCache:
+    """
+    On-disk cache of optimized functions, stored as JSON in `path` under the
+    hash of the function before optimization (see `fn_key`). The entries are
+    evicted in least-recently-used order, the modification time of an entry
+    being updated when it is used, once the cache grows over `max_bytes`.
+    """
+
+    def __init__(self, path, salt, max_bytes=256 << 20):
+        from collections import OrderedDict
+        import os
+
+        self.path: str = path
+        self.salt: str = salt
+        self.max_bytes: int = max_bytes
+        # Key -> size of the entry, least recently used first.
+        self.entries: OrderedDict = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evicted: int = 0
+        os.makedirs(path, exist_ok=True)
+        found = []
+        for sub in os.scandir(path):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith(".json"):
+                    st = entry.stat()
+                    found.append((st.st_mtime, entry.name[: -len(".json")], st.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+        return
+
+    def entry_path(self, key):
+        import os
+
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """
+        Optimized function stored under `key`, or `None`.
+        """
+        import json
+        import os
+
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            with open(self.entry_path(key)) as f:
+                fn = json.load(f)
+            os.utime(self.entry_path(key))
+        except (OSError, ValueError):
+            # Evicted by another process, or written halfway.
+            self.size -= self.entries.pop(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return fn
+
+    def put(self, key, fn):
+        import json
+        import os
+
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        text = json.dumps(fn, separators=(",", ":"))
+        # Written aside then renamed, so that readers never see half an entry.
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+        if key in self.entries:
+            self.size -= self.entries.pop(key)
+        self.entries[key] = len(text)
+        self.size += len(text)
+        self.evict()
+        return
+
+    def evict(self):
+        import os
+
+        while self.size > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.evicted += 1
+            try:
+                os.remove(self.entry_path(key))
+            except FileNotFoundError:
+                pass
+        return
+
+    def clear(self):
+        self.max_bytes, max_bytes = 0, self.max_bytes
+        self.evict()
+        self.max_bytes = max_bytes
+        return
+
+    def map_fns(self, fn_pass, fns, jobs=1, stats=None, name=None):
+        """
+        Same as `utils.run_fns`, only running `fn_pass` on the functions that
+        are not in the cache, and storing the results.
+        """
+        from itertools import islice
+        from utils import run_fns
+
+        if stats is not None:
+            stats.cache = self
+        fns = iter(fns)
+        while True:
+            batch = list(islice(fns, BATCH_FNS))
+            if not batch:
+                return
+            keys = [fn_key(fn, self.salt) for fn in batch]
+            results = [self.get(key) for key in keys]
+            todo = [i for i, fn in enumerate(results) if fn is None]
+            done = run_fns(fn_pass, [batch[i] for i in todo], jobs, stats, name)
+            for i, fn in zip(todo, done):
+                self.put(keys[i], fn)
+                results[i] = fn
+            yield from results
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            evicted=self.evicted,
+            entries=len(self.entries),
+            bytes=self.size,
+        )
+
+
+@click.command()
+@click.argument("path", type=click.Path(file_okay=False))
+@click.option("--clear", is_flag=True, help="Remove every entry.")
+def main(path, clear):
+    """
+    Prints the size of the function cache in PATH as JSON.
+    """
+    import json
+
+    cache = FnCache(path, salt="")
+    if clear:
+        cache.clear()
+    print(json.dumps(cache.summary()))
+    return
+
+
+if __name__ == "__main__":
+    main()
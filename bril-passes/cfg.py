@@ -1,11 +1,12 @@
 #! /usr/bin/env python
 
+import click
+
 TERMINATORS = (
     "br",
     "jmp",
     "ret",
 )
-DEBUG = False
 
 
 def is_label(instr):
@@ -22,103 +23,248 @@ def get_block_name(first_instr, i):
     return ret, i
 
 
+def get_succs(instrs, next_name):
+    """
+    Successors of a block given its instructions and the name of the block
+    following it in the function (`None` for the last block).
+    """
+    last = instrs[-1] if instrs else {}
+    op = last.get("op", "not_an_op")
+    if op == "br":
+        # FIXME
+        return last["labels"][:] if "labels" in last else last["args"][1:]
+    if op == "jmp":
+        return last["labels"][:] if "labels" in last else last["args"][:]
+    if op == "ret" or next_name is None:
+        return []
+    # Fallthrough.
+    return [next_name]
+
+
 def form_cfg(body, bnum):
     cfg = []
 
     # Handling empty function.
     if len(body) == 0:
-        cfg = [dict(name="#b0", instrs=[], succs=[])]
+        cfg = [dict(name="#b0", instrs=[], succs=[], preds=[])]
         return cfg, bnum
 
     new_block = True
-    for i, instr in enumerate(body):
+    for instr in body:
         if new_block or is_label(instr):
             bname, bnum = get_block_name(instr, bnum)
-            cfg.append(dict(name=bname, instrs=[], succs=[]))
-            # Handle fallthrough from previous block
-            if is_label(instr):
-                fallthrough = cfg[-2]["instrs"][-1] not in TERMINATORS
-                if fallthrough and bname not in cfg[-2]["succs"]:
-                    cfg[-2]["succs"].append(bname)
+            cfg.append(dict(name=bname, instrs=[], succs=[], preds=[]))
             new_block = False
-
         if instr.get("op", "not_an_op") in TERMINATORS:
-            if instr["op"] in ("br", "jmp"):
-                # FIXME
-                if instr["op"] == "br":
-                    try:
-                        cfg[-1]["succs"] = instr["args"][1:]
-                    except KeyError:
-                        cfg[-1]["succs"] = instr["labels"][:]
-                if instr["op"] == "jmp":
-                    try:
-                        cfg[-1]["succs"] = instr["labels"][:]
-                    except KeyError:
-                        cfg[-1]["succs"] = instr["args"][:]
-
             new_block = True
         cfg[-1]["instrs"].append(instr)
+
+    for i, block in enumerate(cfg):
+        next_name = cfg[i + 1]["name"] if i + 1 < len(cfg) else None
+        block["succs"] = get_succs(block["instrs"], next_name)
+    index = {block["name"]: i for i, block in enumerate(cfg)}
+    for block in cfg:
+        for succ in block["succs"]:
+            cfg[index[succ]]["preds"].append(block["name"])
     return cfg, bnum
 
 
+class CFG:
+    """
+    Control-flow graph of a function, kept alive across passes. The blocks
+    are in program order and each one is a dictionary:
+    {
+        "name": ...,
+        "instrs": [...],
+        "succs": [...],
+        "preds": [...],
+    }
+    Passes replace the instructions of a block through `update_block`, which
+    only recomputes the edges of that block. The function body is flattened
+    again only when asked for, and only if some block changed. The block
+    orders are computed once, when first asked for, and again only after
+    the edges changed.
+    """
+
+    def __init__(self, blocks):
+        self.blocks: list = blocks
+        self.index: dict = {block["name"]: i for i, block in enumerate(blocks)}
+        self.dirty: set = set()
+        self.instrs: list = []
+        for block in blocks:
+            self.instrs += block["instrs"]
+        # Positions of the reachable blocks in postorder, `None` until needed.
+        self.order: list = None
+        return
+
+    @classmethod
+    def from_instrs(cls, instrs, bnum=0):
+        blocks, bnum = form_cfg(instrs, bnum)
+        return cls(blocks), bnum
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __getitem__(self, name):
+        return self.blocks[self.index[name]]
+
+    def update_block(self, i, instrs):
+        block = self.blocks[i]
+        block["instrs"] = instrs
+        self.dirty.add(i)
+        next_name = self.blocks[i + 1]["name"] if i + 1 < len(self.blocks) else None
+        succs = get_succs(instrs, next_name)
+        if succs != block["succs"]:
+            for succ in block["succs"]:
+                self[succ]["preds"].remove(block["name"])
+            for succ in succs:
+                self[succ]["preds"].append(block["name"])
+            block["succs"] = succs
+            self.order = None
+        return
+
+    def remove_blocks(self, positions):
+        """
+        Removes the blocks at `positions`, which must not be reached by
+        falling through from a kept block.
+        """
+        removed = {self.blocks[i]["name"] for i in positions}
+        self.blocks = [
+            block for i, block in enumerate(self.blocks) if i not in positions
+        ]
+        for block in self.blocks:
+            block["preds"] = [pred for pred in block["preds"] if pred not in removed]
+        self.index = {block["name"]: i for i, block in enumerate(self.blocks)}
+        self.dirty = set(range(len(self.blocks)))
+        self.order = None
+        return
+
+    def postorder(self):
+        """
+        Positions of the blocks in postorder of a depth-first search from
+        the entry block. Unreachable blocks are left out.
+        """
+        if self.order is not None:
+            return self.order
+        order = []
+        if self.blocks:
+            visited = {0}
+            stack = [(0, iter(self.blocks[0]["succs"]))]
+            while stack:
+                i, succs = stack[-1]
+                for succ in succs:
+                    j = self.index[succ]
+                    if j not in visited:
+                        visited.add(j)
+                        stack.append((j, iter(self.blocks[j]["succs"])))
+                        break
+                else:
+                    stack.pop()
+                    order.append(i)
+        self.order = order
+        return order
+
+    def reverse_postorder(self):
+        return self.postorder()[::-1]
+
+    def remove_unreachable(self):
+        """
+        Removes the blocks that cannot be reached from the entry block.
+        Returns how many were removed.
+        """
+        reachable = set(self.postorder())
+        unreachable = {i for i in range(len(self.blocks)) if i not in reachable}
+        if unreachable:
+            self.remove_blocks(unreachable)
+        return len(unreachable)
+
+    def get_instrs(self):
+        if self.dirty:
+            self.instrs = []
+            for block in self.blocks:
+                self.instrs += block["instrs"]
+            self.dirty = set()
+        return self.instrs
+
+    def to_json(self):
+        return self.blocks
+
+
 def cfg2bril(cfg):
     from copy import copy
 
     prg = copy(cfg)
     for i, fn in enumerate(cfg["functions"]):
-        instrs = []
-        for block in fn["cfg"]:
-            instrs += block["instrs"]
-        prg["functions"][i]["instrs"] = instrs[:]
+        prg["functions"][i]["instrs"] = fn["cfg"].get_instrs()[:]
         del prg["functions"][i]["cfg"]
     return prg
 
 
-def create_left_justified_label(text):
-    lines = [line for line in text.split("\n") if line.strip()]
+def run_on_cfg(fn_pass, fn):
+    """
+    Runs `fn_pass` on the CFG of a function (formed if the function does not
+    carry one yet) and flattens it back to instructions.
+    """
+    if "cfg" not in fn:
+        fn["cfg"], _ = CFG.from_instrs(fn["instrs"])
+    fn = fn_pass(fn)
+    fn["instrs"] = fn.pop("cfg").get_instrs()[:]
+    return fn
+
+
+def create_left_justified_label(lines):
+    # A table needs at least one row.
+    lines = lines or [""]
     rows = "".join(f'  <TR><TD ALIGN="LEFT">{line}</TD></TR>\n' for line in lines)
     html_label = f'<TABLE BORDER="1" CELLBORDER="0" CELLSPACING="0" CELLPADDING="4">\n{rows}</TABLE>'
     return html_label
 
 
-def cfg2dot(fname: str, cfg):
-    import pydot
+def dot_id(name):
+    escaped = name.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
 
-    g = pydot.Dot(fname, graph_type="digraph")
+def write_dot(file, fname, cfg):
+    """
+    Writes the CFG of the function `fname` to `file` in DOT format, one block
+    at a time.
+    """
+    from html import escape
+
+    file.write(f"digraph {dot_id(fname)} {{\n")
     for block in cfg:
-        node_txt = ""
-        for instr in block["instrs"]:
-            instr_txt = json2bril(instr)
-            node_txt += instr_txt + "\n"
-        node = pydot.Node(
-            block["name"],
-            label=f"<{create_left_justified_label(node_txt)}>",
-            shape="plaintext",
-            xlabel=block["name"],
-        )
-        g.add_node(node)
+        lines = [escape(json2bril(instr)) for instr in block["instrs"]]
+        name = dot_id(block["name"])
+        label = create_left_justified_label(lines)
+        file.write(f"  {name} [label=<{label}>, shape=plaintext, xlabel={name}];\n")
         for succ in block["succs"]:
-            e = pydot.Edge(block["name"], succ)
-            g.add_edge(e)
-    return g
+            file.write(f"  {name} -> {dot_id(succ)};\n")
+    file.write("}\n")
+    return
 
 
-def json2bril(instr):
-    import sys
+def cfg2dot(fname: str, cfg):
+    from io import StringIO
 
-    sys.path.append("../../bril/bril-txt")
-    import briltxt
+    dot = StringIO()
+    write_dot(dot, fname, cfg)
+    return dot.getvalue()
 
-    if is_label(instr):
-        instr_txt = f".{instr['label']}:"
-    else:
-        instr_txt = briltxt.instr_to_string(instr)
-    return instr_txt
+
+def json2bril(instr):
+    from printer import instr_to_str
+
+    return instr_to_str(instr)
 
 
 def get_cfg(prg):
     """
-    Creates a CFG out of a `bril` program.
+    Creates a CFG out of a `bril` program. Functions that already carry a
+    CFG keep it, so that passes can be chained without rebuilding it.
     The CFG program is:
     {
         "functions": [
@@ -127,13 +273,16 @@ def get_cfg(prg):
                 "args": ...,
                 "type": ...,
                 "instrs": [...],
-                "cfg": [
-                    {
-                        "bname": ...,
-                        "instrs: [...],
-                        "succs": [...],
-                    }
-                ]
+                "cfg": CFG(
+                    [
+                        {
+                            "name": ...,
+                            "instrs: [...],
+                            "succs": [...],
+                            "preds": [...],
+                        }
+                    ]
+                )
             }
         ]
     }
@@ -142,21 +291,32 @@ def get_cfg(prg):
     bnum = 0
     for fn in prg["functions"]:
         cfg_prg.append(fn)
-        cfg, bnum = form_cfg(fn["instrs"], bnum)
-        cfg_prg[-1]["cfg"] = cfg
+        if "cfg" not in fn:
+            fn["cfg"], bnum = CFG.from_instrs(fn["instrs"], bnum)
     cfg_prg = dict(functions=cfg_prg)
     return cfg_prg
 
 
-def main():
+@click.command()
+@click.option(
+    "--dot-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Also write the CFG of every function to `{function}.dot` in this directory.",
+)
+def main(dot_dir):
+    from utils import load_prg
     import json
+    import os
 
     prg = load_prg()
     cfg_prg = get_cfg(prg)
-    if DEBUG:
-        for fn in cfg_prg["functions"]:
-            graph = cfg2dot(fn["name"], fn["cfg"])
-            graph.write_png(f"{fn['name']}_graph.png")
+    for fn in cfg_prg["functions"]:
+        if dot_dir is not None:
+            os.makedirs(dot_dir, exist_ok=True)
+            with open(os.path.join(dot_dir, f"{fn['name']}.dot"), "w") as f:
+                write_dot(f, fn["name"], fn["cfg"])
+        fn["cfg"] = fn["cfg"].to_json()
     print(json.dumps(cfg_prg))
     return
 
@@ -1,9 +1,55 @@
 #! /usr/bin/env python3
 
+import click
+from stats import stats_options
+
+
+# Evaluation of the foldable operations on constant arguments.
+FOLDS = {
+    "add": lambda a, b: a + b,
+    "mul": lambda a, b: a * b,
+    "sub": lambda a, b: a - b,
+    # Rounding towards zero, as `bril` does.
+    "div": lambda a, b: a // b if (a >= 0) == (b > 0) else -(-a // b),
+    "and": lambda a, b: a and b,
+    "or": lambda a, b: a or b,
+    "eq": lambda a, b: a == b,
+    "ge": lambda a, b: a >= b,
+    "le": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "lt": lambda a, b: a < b,
+    "not": lambda a: not a,
+}
+# Integer operations, whose results wrap around to 64 bits as in `brili`.
+INT_FOLDS = ("add", "mul", "sub", "div")
+# Boolean operations whose result is known as soon as one argument is this
+# constant.
+ABSORBING = {"and": False, "or": True}
+
+
+def fold_consts(op, vals):
+    """
+    Value of `op` on the constant arguments `vals`, `None` if it cannot be
+    folded.
+    """
+    from interp import INT_MIN, INT_MAX, wrap
+
+    if op not in FOLDS:
+        return None
+    try:
+        val = FOLDS[op](*vals)
+    except ZeroDivisionError:
+        # Left for the program to fail at runtime.
+        return None
+    if op in INT_FOLDS and not INT_MIN <= val <= INT_MAX:
+        val = wrap(val)
+    return val
+
 
 def build_const_instr(instr, val):
     instr["op"] = "const"
     instr["value"] = val
+    instr.pop("args", None)
     return instr
 
 
@@ -25,55 +71,30 @@ def cfold_instr(instr, lvn_table):
         val0 = lvn_table.table[valn0][0]
         val1 = lvn_table.table[valn1][0]
 
-        if op in ("eq", "ge", "le", "gt", "lt"):
-            if val0 == val1:
-                if op in ("eq", "ge", "le"):
-                    instr = build_const_instr(instr, True)
-                if op in ("gt", "lt"):
-                    instr = build_const_instr(instr, False)
-                return instr, True
-            if val0[0] == val1[0] == "const":
-                if op == "eq":
-                    instr = build_const_instr(instr, val0[-1] == val1[-1])
-                if op == "ge":
-                    instr = build_const_instr(instr, val0[-1] >= val1[-1])
-                if op == "le":
-                    instr = build_const_instr(instr, val0[-1] <= val1[-1])
-                if op == "gt":
-                    instr = build_const_instr(instr, val0[-1] > val1[-1])
-                if op == "lt":
-                    instr = build_const_instr(instr, val0[-1] < val1[-1])
-                return instr, True
+        if op in ("eq", "ge", "le", "gt", "lt") and val0 == val1:
+            if op in ("eq", "ge", "le"):
+                instr = build_const_instr(instr, True)
+            if op in ("gt", "lt"):
+                instr = build_const_instr(instr, False)
+            return instr, True
 
-        if op in ("add", "mul", "div", "sub", "and", "or"):
-            fn = {
-                "add": lambda a, b: a + b,
-                "mul": lambda a, b: a * b,
-                "sub": lambda a, b: a - b,
-                "div": lambda a, b: a // b,
-                "and": lambda a, b: a and b,
-                "or": lambda a, b: a or b,
-            }[op]
-            if val0[0] == val1[0] == "const":
-                constval = fn(val0[-1], val1[-1])
+        if val0[0] == val1[0] == "const":
+            constval = fold_consts(op, (val0[-1], val1[-1]))
+            if constval is not None:
                 instr = build_const_instr(instr, constval)
                 return instr, True
 
-        if op in ("and", "or"):
-            if op == "and":
-                if val0 == cval(instr, False) or val1 == cval(instr, False):
-                    instr = build_const_instr(instr, False)
-                    return instr, True
-            if op == "or":
-                if val0 == cval(instr, True) or val1 == cval(instr, True):
-                    instr = build_const_instr(instr, True)
-                    return instr, True
+        if op in ABSORBING:
+            absorbing = cval(instr, ABSORBING[op])
+            if val0 == absorbing or val1 == absorbing:
+                instr = build_const_instr(instr, ABSORBING[op])
+                return instr, True
 
     if instr_type == InstrType.VALUE and op == "not":
         valn = lvn_table.var2valn(args[0])
         val = lvn_table.table[valn][0]
         if val[0] == "const":
-            instr = build_const_instr(instr, not val[-1])
+            instr = build_const_instr(instr, fold_consts(op, (val[-1],)))
             return instr, True
 
     if instr_type == InstrType.CTRL and op == "br":
@@ -81,46 +102,55 @@ def cfold_instr(instr, lvn_table):
         val = lvn_table.table[valn][0]
         if val[0] == "const":
             instr["op"] = "jmp"
-            instr["args"] = [args[1] if val[-1] else args[2]]
+            # FIXME
+            if "labels" in instr:
+                labels = instr["labels"]
+                instr["labels"] = [labels[0] if val[-1] else labels[1]]
+                del instr["args"]
+            else:
+                instr["args"] = [args[1] if val[-1] else args[2]]
             return instr, True
 
     return instr, False
 
 
 def cfold_block(body):
+    """
+    Folds the constants of a block during a single LVN walk: every value is
+    folded as soon as it is numbered, so later instructions already see the
+    folded constants.
+    """
     from lvn import lvn_block
 
-    glb_changed = True
-    new_body = body
-    while glb_changed:
-        body, lvn_table = lvn_block(new_body)
-        glb_changed = False
-        new_body = []
-        for instr in body:
-            new_instr, changed = cfold_instr(instr, lvn_table)
-            glb_changed |= changed
-            new_body.append(new_instr)
+    new_body, _ = lvn_block(body, fold=cfold_instr)
     return new_body
 
 
-def cfold_prg(prg):
-    from cfg import get_cfg, cfg2bril
+def cfold_fn(fn):
+    for i, block in enumerate(fn["cfg"]):
+        fn["cfg"].update_block(i, cfold_block(block["instrs"]))
+    return fn
+
+
+def cfold_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
 
-    prg = get_cfg(prg)
-    for fn in prg["functions"]:
-        for block in fn["cfg"]:
-            block["instrs"] = cfold_block(block["instrs"])
-    prg = cfg2bril(prg)
-    return prg
+    fn_pass = partial(run_on_cfg, cfold_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="cfold")
 
 
-def main():
-    from utils import load_prg
-    import json
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
 
+    binary = is_binary_input()
     prg = load_prg()
-    prg = cfold_prg(prg)
-    print(json.dumps(prg))
+    prg = cfold_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
     return
 
 
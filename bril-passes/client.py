@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+
+# Only the standard library is imported, so that the client starts faster
+# than the pass scripts it replaces.
+import os
+import socket
+import sys
+
+# Socket of the optimizer server (see `server.py`), unless given otherwise.
+DEFAULT_SOCKET = os.environ.get(
+    "BRIL_OPT_SOCKET",
+    os.path.join(os.environ.get("TMPDIR", "/tmp"), f"bril-opt-{os.getuid()}.sock"),
+)
+CHUNK_BYTES = 1 << 16
+
+
+def request(passes, infile, outfile, path=DEFAULT_SOCKET, stats=False):
+    """
+    Sends the program read from the binary file `infile` to the server
+    listening on `path`, to be optimized by `passes` (comma-separated), and
+    writes the optimized program to the binary file `outfile`. Returns the
+    header of the response, a dictionary with "ok" and either "error" or,
+    if `stats` is set, "stats".
+
+    The request is a JSON header line followed by the program, up to the
+    end of the stream. The response is laid out the same way.
+    """
+    import json
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        header = dict(passes=passes, stats=stats)
+        sock.sendall(json.dumps(header).encode() + b"\n")
+        while data := infile.read(CHUNK_BYTES):
+            sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        buf = b""
+        while b"\n" not in buf:
+            data = sock.recv(CHUNK_BYTES)
+            if not data:
+                raise ConnectionError("The server closed the connection.")
+            buf += data
+        line, buf = buf.split(b"\n", 1)
+        header = json.loads(line)
+        if header["ok"]:
+            outfile.write(buf)
+            while data := sock.recv(CHUNK_BYTES):
+                outfile.write(data)
+    return header
+
+
+def main():
+    """
+    usage: client.py [--socket PATH] [--stats] PASSES
+
+    Optimizes the program on stdin with the comma-separated PASSES (see
+    `opt.PASSES`) on the server, e.g. `client.py lvn,tdce` in place of
+    `python lvn.py | python tdce.py`.
+    """
+    import json
+
+    args = sys.argv[1:]
+    path = DEFAULT_SOCKET
+    stats = False
+    passes = None
+    while args:
+        arg = args.pop(0)
+        if arg == "--socket" and args:
+            path = args.pop(0)
+        elif arg == "--stats":
+            stats = True
+        elif arg in ("-h", "--help"):
+            print(main.__doc__.strip("\n"))
+            return 0
+        elif passes is None and not arg.startswith("-"):
+            passes = arg
+        else:
+            passes = None
+            break
+    if passes is None:
+        print(main.__doc__.strip("\n"), file=sys.stderr)
+        return 2
+    try:
+        header = request(passes, sys.stdin.buffer, sys.stdout.buffer, path, stats)
+    except OSError as e:
+        print(f"Error: cannot reach the server on {path}: {e}", file=sys.stderr)
+        return 1
+    if not header["ok"]:
+        print(f"Error: {header['error']}", file=sys.stderr)
+        return 1
+    if stats:
+        json.dump(header["stats"], sys.stderr)
+        sys.stderr.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+#! /usr/bin/env python3
+
+import click
+from dataclasses import dataclass
+
+ANALYSES = ("reaching-defs", "live-vars", "available-exprs")
+
+
+class Domain:
+    """
+    Finite set of facts (definitions, variables, expressions, ...), each one
+    mapped to a bit so that sets of facts are plain integers: union is `|`,
+    intersection is `&` and a transfer function is a few integer operations
+    however many facts there are.
+    """
+
+    def __init__(self, items=()):
+        self.items: list = []
+        self.index: dict = dict()
+        for item in items:
+            self.add(item)
+        return
+
+    def add(self, item):
+        if item not in self.index:
+            self.index[item] = len(self.items)
+            self.items.append(item)
+        return 1 << self.index[item]
+
+    def bit(self, item):
+        return 1 << self.index[item]
+
+    def bits(self, items):
+        bits = 0
+        for item in items:
+            bits |= 1 << self.index[item]
+        return bits
+
+    def to_set(self, bits):
+        items = []
+        i = 0
+        while bits:
+            if bits & 1:
+                items.append(self.items[i])
+            bits >>= 1
+            i += 1
+        return items
+
+    def full(self):
+        return (1 << len(self.items)) - 1
+
+    def __len__(self):
+        return len(self.items)
+
+
+@dataclass
+class Solution:
+    # Facts at the entry and at the exit of every block, by block position,
+    # whatever the direction of the analysis.
+    ins: list
+    outs: list
+    domain: Domain
+
+
+def solve(cfg, transfer, domain, forward=True, meet="union", boundary=0):
+    """
+    Solves a dataflow problem on `cfg` with a worklist ordered by reverse
+    postorder (postorder for backward problems), so that a block is usually
+    visited after the blocks its input depends on and acyclic regions
+    converge in one visit.
+
+    `transfer(i, bits)` maps the facts flowing into block `i` (its entry for
+    forward problems, its exit for backward ones) to the facts flowing out of
+    it. `meet` is "union" or "intersection", `boundary` the facts at the
+    entry of the function (forward) or at its exits (backward).
+    """
+    from heapq import heappush, heappop
+
+    nblocks = len(cfg)
+    # Top of the lattice: the identity of the meet.
+    top = 0 if meet == "union" else domain.full()
+    succs = [[cfg.index[succ] for succ in block["succs"]] for block in cfg]
+    preds = [[cfg.index[pred] for pred in block["preds"]] for block in cfg]
+    if forward:
+        srcs, dsts = preds, succs
+    else:
+        srcs, dsts = succs, preds
+    # Postorder of the CFG approximates the reverse postorder of the
+    # reversed CFG.
+    order = cfg.reverse_postorder() if forward else cfg.postorder()[:]
+    # Unreachable blocks still get a solution.
+    seen = set(order)
+    order += [i for i in range(nblocks) if i not in seen]
+    rank = [0] * nblocks
+    for k, i in enumerate(order):
+        rank[i] = k
+
+    # `before` flows into the transfer functions, `after` out of them.
+    before = [top] * nblocks
+    after = [top] * nblocks
+    # The worklist holds ranks, starting with every block.
+    worklist = list(range(nblocks))
+    queued = [True] * nblocks
+    while worklist:
+        i = order[heappop(worklist)]
+        queued[i] = False
+        is_boundary = i == 0 if forward else len(succs[i]) == 0
+        bits = boundary if is_boundary else top
+        for j in srcs[i]:
+            bits = bits | after[j] if meet == "union" else bits & after[j]
+        before[i] = bits
+        bits = transfer(i, bits)
+        if bits != after[i]:
+            after[i] = bits
+            for j in dsts[i]:
+                if not queued[j]:
+                    queued[j] = True
+                    heappush(worklist, rank[j])
+    if forward:
+        return Solution(before, after, domain)
+    return Solution(after, before, domain)
+
+
+def gen_kill(gen, kill):
+    """
+    Transfer function of a gen/kill problem with one `gen` and one `kill`
+    set per block.
+    """
+
+    def transfer(i, bits):
+        return gen[i] | (bits & ~kill[i])
+
+    return transfer
+
+
+def reaching_defs(cfg):
+    """
+    Definitions reaching the entry and the exit of every block. A definition
+    is the position `(block, instr)` of the instruction defining it.
+    """
+    domain = Domain()
+    # Definitions of every variable.
+    var_defs = dict()
+    for i, block in enumerate(cfg):
+        for j, instr in enumerate(block["instrs"]):
+            if "dest" in instr:
+                bit = domain.add((i, j))
+                var_defs[instr["dest"]] = var_defs.get(instr["dest"], 0) | bit
+    gen = []
+    kill = []
+    for i, block in enumerate(cfg):
+        last = dict()
+        for j, instr in enumerate(block["instrs"]):
+            if "dest" in instr:
+                last[instr["dest"]] = domain.bit((i, j))
+        gen.append(sum(last.values()))
+        block_kill = 0
+        for var in last:
+            block_kill |= var_defs[var]
+        kill.append(block_kill)
+    return solve(cfg, gen_kill(gen, kill), domain, forward=True, meet="union")
+
+
+def block_uses_defs(instrs):
+    """
+    Variables read by `instrs` before being defined, and variables defined.
+    """
+    uses = []
+    defs = set()
+    for instr in instrs:
+        for arg in instr.get("args", []):
+            if arg not in defs:
+                uses.append(arg)
+        if "dest" in instr:
+            defs.add(instr["dest"])
+    return uses, defs
+
+
+def live_vars(cfg):
+    """
+    Variables live at the entry and at the exit of every block.
+    """
+    domain = Domain()
+    gen = []
+    kill = []
+    for block in cfg:
+        uses, defs = block_uses_defs(block["instrs"])
+        gen.append(sum(domain.add(var) for var in set(uses)))
+        kill.append(sum(domain.add(var) for var in defs))
+    return solve(cfg, gen_kill(gen, kill), domain, forward=False, meet="union")
+
+
+def get_expr(instr):
+    """
+    Expression computed by a value instruction, `None` for other
+    instructions. Arguments of commutative operations are sorted.
+    """
+    from utils import get_instr_type, InstrType, commutes, has_side_effects
+
+    if get_instr_type(instr) is not InstrType.VALUE or has_side_effects(instr):
+        return None
+    args = instr.get("args", [])
+    if commutes(instr):
+        args = sorted(args)
+    return (instr["op"], *instr.get("funcs", []), *args)
+
+
+def available_exprs(cfg):
+    """
+    Expressions available at the entry and at the exit of every block: computed
+    on every path reaching that point, with none of their arguments redefined
+    since.
+    """
+    domain = Domain()
+    # Expressions using every variable.
+    users = dict()
+    for block in cfg:
+        for instr in block["instrs"]:
+            expr = get_expr(instr)
+            if expr is not None:
+                bit = domain.add(expr)
+                for arg in set(instr.get("args", [])):
+                    users[arg] = users.get(arg, 0) | bit
+    gen = []
+    kill = []
+    for block in cfg:
+        block_gen = 0
+        block_kill = 0
+        for instr in block["instrs"]:
+            expr = get_expr(instr)
+            if expr is not None:
+                block_gen |= domain.bit(expr)
+            if "dest" in instr:
+                killed = users.get(instr["dest"], 0)
+                block_gen &= ~killed
+                block_kill |= killed
+        gen.append(block_gen)
+        kill.append(block_kill)
+    return solve(cfg, gen_kill(gen, kill), domain, forward=True, meet="intersection")
+
+
+def run_analysis(name, cfg):
+    analyses = {
+        "reaching-defs": reaching_defs,
+        "live-vars": live_vars,
+        "available-exprs": available_exprs,
+    }
+    return analyses[name](cfg)
+
+
+def fmt_facts(name, cfg, facts):
+    if name == "reaching-defs":
+        facts = [
+            f"{cfg.blocks[i]['instrs'][j]['dest']}@{cfg.blocks[i]['name']}.{j}"
+            for i, j in facts
+        ]
+    elif name == "available-exprs":
+        facts = [" ".join(str(x) for x in expr) for expr in facts]
+    return ", ".join(sorted(facts)) if facts else "∅"
+
+
+@click.command()
+@click.option("--analysis", type=click.Choice(ANALYSES), default="live-vars")
+def main(analysis):
+    """
+    Prints the facts at the entry and exit of every block.
+    """
+    from cfg import get_cfg
+    from utils import load_prg
+
+    prg = get_cfg(load_prg())
+    for fn in prg["functions"]:
+        cfg = fn["cfg"]
+        solution = run_analysis(analysis, cfg)
+        print(f"@{fn['name']}")
+        for i, block in enumerate(cfg):
+            print(f"  {block['name']}:")
+            ins = solution.domain.to_set(solution.ins[i])
+            outs = solution.domain.to_set(solution.outs[i])
+            print(f"    in:  {fmt_facts(analysis, cfg, ins)}")
+            print(f"    out: {fmt_facts(analysis, cfg, outs)}")
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+
+import click
+
+
+def get_idoms(cfg):
+    """
+    Immediate dominator of every block, by position, with the algorithm of
+    Cooper, Harvey and Kennedy: the dominator tree is refined in reverse
+    postorder until it converges, intersecting the dominators of the
+    predecessors by walking up the tree. The entry block is its own immediate
+    dominator and unreachable blocks have `None`.
+    """
+    order = cfg.postorder()
+    rank = [None] * len(cfg)
+    for k, i in enumerate(order):
+        rank[i] = k
+    preds = [[cfg.index[pred] for pred in block["preds"]] for block in cfg]
+    idoms = [None] * len(cfg)
+    if not order:
+        return idoms
+    idoms[0] = 0
+
+    def intersect(i, j):
+        while i != j:
+            while rank[i] < rank[j]:
+                i = idoms[i]
+            while rank[j] < rank[i]:
+                j = idoms[j]
+        return i
+
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(order):
+            if i == 0:
+                continue
+            idom = None
+            for j in preds[i]:
+                if idoms[j] is None:
+                    continue
+                idom = j if idom is None else intersect(j, idom)
+            if idoms[i] != idom:
+                idoms[i] = idom
+                changed = True
+    return idoms
+
+
+def get_dom_tree(idoms):
+    """
+    Children of every block in the dominator tree, by position.
+    """
+    children = [[] for _ in idoms]
+    for i, idom in enumerate(idoms):
+        if idom is not None and idom != i:
+            children[idom].append(i)
+    return children
+
+
+def get_frontiers(cfg, idoms):
+    """
+    Dominance frontier of every block, by position: the blocks where its
+    dominance ends. Only the predecessors of join points are walked up the
+    dominator tree, as in Cooper, Harvey and Kennedy.
+    """
+    frontiers = [set() for _ in idoms]
+    for i, block in enumerate(cfg):
+        if idoms[i] is None or len(block["preds"]) < 2:
+            continue
+        for pred in block["preds"]:
+            j = cfg.index[pred]
+            if idoms[j] is None:
+                continue
+            while j != idoms[i]:
+                frontiers[j].add(i)
+                j = idoms[j]
+    return frontiers
+
+
+def dominates(idoms, i, j):
+    """
+    Whether block `i` dominates block `j`.
+    """
+    while j != i:
+        if idoms[j] is None or idoms[j] == j:
+            return False
+        j = idoms[j]
+    return True
+
+
+@click.command()
+def main():
+    """
+    Prints the dominator tree and the dominance frontiers of every function.
+    """
+    from cfg import get_cfg
+    from utils import load_prg
+
+    prg = get_cfg(load_prg())
+    for fn in prg["functions"]:
+        cfg = fn["cfg"]
+        idoms = get_idoms(cfg)
+        frontiers = get_frontiers(cfg, idoms)
+        print(f"@{fn['name']}")
+        for i, block in enumerate(cfg):
+            idom = "-" if idoms[i] is None else cfg.blocks[idoms[i]]["name"]
+            frontier = ", ".join(sorted(cfg.blocks[j]["name"] for j in frontiers[i]))
+            print(f"  {block['name']}: idom {idom}, frontier {{{frontier}}}")
+    return
+
+
+if __name__ == "__main__":
+    main()
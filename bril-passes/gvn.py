@@ -0,0 +1,181 @@
+#! /usr/bin/env python3
+
+import click
+from lvn import LVNTable
+from stats import count, count_instrs, stats_options
+from utils import is_sequence_but_not_string
+
+
+class GVNTable(LVNTable):
+    """
+    Value table shared by the whole function, scoped over the dominator tree:
+    the values computed in a block are only found again in the blocks it
+    dominates, where their variable is available.
+
+    Values are built as in `LVNTable`, except for `phi`s, which only match
+    `phi`s of the same block with the same arguments.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Name of the block being numbered.
+        self.block: str = None
+        # Values added by every open scope, to forget them when leaving it.
+        self.scopes: list = []
+        return
+
+    def build_val(self, instr):
+        if instr.get("op", None) != "phi":
+            return super().build_val(instr)
+        valns = self.var2valn(instr["args"])
+        if len(set(valns)) == 1:
+            # The `phi` is a copy.
+            return self.table[valns[0]][0]
+        return ["phi", self.block, *zip(instr["labels"], valns)]
+
+    def var2valn(self, var):
+        if is_sequence_but_not_string(var):
+            return [self.var2valn(x) for x in var]
+        if var not in self.var2valn_map:
+            # Function arguments and variables read by a `phi` before their
+            # definition is numbered. In SSA form, the variable is available
+            # wherever it is read, so the value is never forgotten.
+            self.var2valn_map[var] = LVNTable.add_val(self, ["globval", var], var)
+        return self.var2valn_map[var]
+
+    def add_val(self, val, var):
+        idx = super().add_val(val, var)
+        self.scopes[-1].append(tuple(val))
+        return idx
+
+    def enter(self, block):
+        self.block = block
+        self.scopes.append([])
+        return
+
+    def leave(self):
+        for val in self.scopes.pop():
+            del self.val2valn_map[val]
+        return
+
+    def get_var(self, var):
+        """
+        Variable holding the value of `var`.
+        """
+        if var not in self.var2valn_map:
+            return var
+        return self.valn2var(self.var2valn_map[var])
+
+
+def is_ssa(cfg, args=()):
+    defined = set(args)
+    for instr in cfg.get_instrs():
+        if "dest" in instr:
+            if instr["dest"] in defined:
+                return False
+            defined.add(instr["dest"])
+    return True
+
+
+def gvn_cfg(cfg):
+    """
+    Global value numbering of a CFG in SSA form: the dominator tree is walked
+    once with a scoped value table, and every definition of a value already
+    computed by a dominating block (or earlier in the same block) is removed,
+    its uses reading the first variable computed instead. Copies, and `phi`s
+    whose arguments all have the same value, are removed the same way.
+    """
+    from dom import get_idoms, get_dom_tree
+
+    idoms = get_idoms(cfg)
+    children = get_dom_tree(idoms)
+    table = GVNTable()
+    new_instrs = [block["instrs"] for block in cfg]
+    removed = 0
+    todo = [(0, True)]
+    while todo:
+        i, entering = todo.pop()
+        if not entering:
+            table.leave()
+            continue
+        block = cfg.blocks[i]
+        table.enter(block["name"])
+        instrs = []
+        for instr in block["instrs"]:
+            if "dest" not in instr:
+                instrs.append(instr)
+                continue
+            val = table.build_val(instr)
+            valn = table.find_val(val)
+            if valn is None:
+                valn = table.add_val(val, instr["dest"])
+                instrs.append(instr)
+            else:
+                removed += 1
+            table.var2valn_map[instr["dest"]] = valn
+        new_instrs[i] = instrs
+        todo.append((i, False))
+        todo += [(j, True) for j in reversed(children[i])]
+
+    # Uses are renamed once every value is numbered, as `phi`s read variables
+    # defined in blocks walked after them.
+    for i, instrs in enumerate(new_instrs):
+        for j, instr in enumerate(instrs):
+            if "args" in instr:
+                args = [table.get_var(arg) for arg in instr["args"]]
+                if args != list(instr["args"]):
+                    instrs[j] = instr.copy()
+                    instrs[j]["args"] = args
+        cfg.update_block(i, instrs)
+    count("gvn.removed", removed)
+    count("gvn.lookups", table.nlookups)
+    count("gvn.hits", table.nhits)
+    return cfg
+
+
+def gvn_fn(fn):
+    """
+    Runs GVN on a function, converting it to SSA form and back if it is not
+    in SSA form already. The round trip is only kept if it leaves fewer
+    instructions, as the copies replacing the `phi`s can cost more than
+    what GVN saved.
+    """
+    from ssa import to_ssa_cfg, from_ssa_cfg
+
+    args = [(arg["name"], arg["type"]) for arg in fn.get("args", [])]
+    if is_ssa(fn["cfg"], [name for name, _ in args]):
+        fn["cfg"] = gvn_cfg(fn["cfg"])
+        return fn
+    # The conversion to SSA form leaves the CFG of `fn` as it is.
+    cfg = to_ssa_cfg(fn["cfg"], args)
+    new_fn = dict(fn, cfg=from_ssa_cfg(gvn_cfg(cfg)))
+    if count_instrs(new_fn) < count_instrs(fn):
+        return new_fn
+    count("gvn.kept")
+    return fn
+
+
+def gvn_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
+
+    fn_pass = partial(run_on_cfg, gvn_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="gvn")
+
+
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
+
+    binary = is_binary_input()
+    prg = load_prg()
+    prg = gvn_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
+    return
+
+
+if __name__ == "__main__":
+    main()
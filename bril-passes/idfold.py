@@ -1,5 +1,8 @@
 #! /usr/bin/env python3
 
+import click
+from stats import stats_options
+
 
 def build_id_instr(instr, arg):
     instr["op"] = "id"
@@ -60,43 +63,41 @@ def idfold_instr(instr, lvn_table):
 
 
 def idfold_block(body):
+    """
+    Folds the identities of a block during a single LVN walk, see
+    `cfold.cfold_block`.
+    """
     from lvn import lvn_block
 
-    glb_changed = True
-    new_body = body
-    while glb_changed:
-        glb_changed = False
-        body, lvn_table = lvn_block(new_body)
-        new_body = []
-        for instr in body:
-            new_instr, changed = idfold_instr(instr, lvn_table)
-            glb_changed |= changed
-            new_body.append(new_instr)
+    new_body, _ = lvn_block(body, fold=idfold_instr)
     return new_body
 
 
-def idfold_prg(prg):
-    from cfg import get_cfg, cfg2bril
+def idfold_fn(fn):
+    for i, block in enumerate(fn["cfg"]):
+        fn["cfg"].update_block(i, idfold_block(block["instrs"]))
+    return fn
+
+
+def idfold_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
 
-    prg = get_cfg(prg)
-    for fn in prg["functions"]:
-        for block in fn["cfg"]:
-            block["instrs"] = idfold_block(block["instrs"])
-    prg = cfg2bril(prg)
-    return prg
+    fn_pass = partial(run_on_cfg, idfold_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="idfold")
 
 
-def main():
-    from utils import load_prg
-    import json
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
 
-    # from sys import stderr
-    # print((80 * "-"), file=stderr)
-    # print("Running id folding...", file=stderr)
-    # print((80 * "-"), file=stderr)
+    binary = is_binary_input()
     prg = load_prg()
-    prg = idfold_prg(prg)
-    print(json.dumps(prg))
+    prg = idfold_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
     return
 
 
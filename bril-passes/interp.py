@@ -0,0 +1,320 @@
+#! /usr/bin/env python3
+
+import click
+import math
+import operator
+import sys
+
+# Integers are 64-bit and wrap around, as in `brili`.
+INT_MIN, INT_MAX = -(1 << 63), (1 << 63) - 1
+# Key of the environment holding the returned value: not a valid variable.
+RET = "@ret"
+
+# Operations computing their value from their arguments alone. Integer
+# arithmetic is compiled apart, as it wraps around.
+VALUE_OPS = {
+    "eq": operator.eq,
+    "lt": operator.lt,
+    "gt": operator.gt,
+    "le": operator.le,
+    "ge": operator.ge,
+    "not": operator.not_,
+    "and": lambda a, b: a and b,
+    "or": lambda a, b: a or b,
+    "id": lambda a: a,
+    "fadd": operator.add,
+    "fsub": operator.sub,
+    "fmul": operator.mul,
+    "feq": operator.eq,
+    "flt": operator.lt,
+    "fgt": operator.gt,
+    "fle": operator.le,
+    "fge": operator.ge,
+    "ceq": operator.eq,
+    "clt": operator.lt,
+    "cgt": operator.gt,
+    "cle": operator.le,
+    "cge": operator.ge,
+    "char2int": ord,
+    "int2char": chr,
+}
+INT_OPS = {
+    "add": operator.add,
+    "sub": operator.sub,
+    "mul": operator.mul,
+}
+
+
+def wrap(val):
+    return (val - INT_MIN) % (1 << 64) + INT_MIN
+
+
+def div(a, b):
+    if b == 0:
+        raise ValueError("Division by zero.")
+    q = a // b if (a >= 0) == (b > 0) else -(-a // b)
+    return q if q <= INT_MAX else wrap(q)
+
+
+def fdiv(a, b):
+    # IEEE division, as JavaScript does for `brili`.
+    if b == 0.0:
+        if a == 0.0 or a != a:
+            return float("nan")
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+    return a / b
+
+
+def value_to_str(val):
+    if isinstance(val, bool):
+        return "true" if val else "false"
+    if isinstance(val, float):
+        if val != val:
+            return "NaN"
+        if math.isinf(val):
+            return "Infinity" if val > 0 else "-Infinity"
+        return f"{val:.17f}"
+    return str(val)
+
+
+def parse_arg(text, type_):
+    if type_ == "bool":
+        if text not in ("true", "false"):
+            raise ValueError(f"Invalid bool argument: {text}.")
+        return text == "true"
+    if type_ == "float":
+        return float(text)
+    if type_ == "char":
+        return text
+    return int(text)
+
+
+class Interpreter:
+    """
+    Interpreter of `bril` programs. Every basic block of a function (see
+    `cfg.form_cfg`) is compiled, when the function is first called, into a
+    closure running the closures of its instructions and returning the
+    position of the next block, or -1 after a `ret`. Variables live in a
+    dictionary per call.
+
+    Dynamic instruction counts are derived from how many times each block
+    ran, which is the only bookkeeping done while running.
+    """
+
+    def __init__(self, prg, out=None):
+        self.fns: dict = {fn["name"]: fn for fn in prg["functions"]}
+        self.out = out or sys.stdout
+        # Function name -> (blocks, visits of each block, sizes of the blocks).
+        self.compiled: dict = dict()
+        return
+
+    @property
+    def count(self):
+        """
+        Instructions run so far, labels excluded.
+        """
+        return sum(
+            sum(n * size for n, size in zip(visits, sizes))
+            for _, visits, sizes in self.compiled.values()
+        )
+
+    def run(self, args=()):
+        """
+        Runs `main` with the arguments `args` given as text.
+        """
+        main = self.fns["main"]
+        params = main.get("args", [])
+        if len(args) != len(params):
+            raise ValueError(f"main expects {len(params)} arguments, got {len(args)}.")
+        return self.call(
+            "main", [parse_arg(arg, p["type"]) for arg, p in zip(args, params)]
+        )
+
+    def call(self, name, args):
+        if name not in self.compiled:
+            self.compiled[name] = self.compile_fn(self.fns[name])
+        blocks, visits, _ = self.compiled[name]
+        env = {
+            param["name"]: arg
+            for param, arg in zip(self.fns[name].get("args", []), args)
+        }
+        i = 0
+        while i >= 0:
+            visits[i] += 1
+            i = blocks[i](env)
+        return env.get(RET, None)
+
+    def compile_fn(self, fn):
+        from cfg import form_cfg
+
+        cfg, _ = form_cfg(fn["instrs"], 0)
+        index = {block["name"]: i for i, block in enumerate(cfg)}
+        blocks, sizes = [], []
+        for i, block in enumerate(cfg):
+            instrs = [instr for instr in block["instrs"] if "label" not in instr]
+            last = instrs[-1].get("op", None) if instrs else None
+            if last in ("br", "jmp", "ret"):
+                term = self.compile_term(instrs.pop(), index)
+            else:
+                # Falls through, or returns at the end of the function.
+                term = self.compile_goto(i + 1 if i + 1 < len(cfg) else -1)
+            ops = tuple(self.compile_instr(instr) for instr in instrs)
+            blocks.append(self.compile_block(ops, term))
+            sizes.append(len(instrs) + (last in ("br", "jmp", "ret")))
+        return blocks, [0] * len(blocks), sizes
+
+    @staticmethod
+    def compile_block(ops, term):
+        if not ops:
+            return term
+
+        def run_block(env):
+            for op in ops:
+                op(env)
+            return term(env)
+
+        return run_block
+
+    @staticmethod
+    def compile_goto(target):
+        return lambda env: target
+
+    def compile_term(self, instr, index):
+        op = instr["op"]
+        if op == "jmp":
+            return self.compile_goto(index[instr["labels"][0]])
+        if op == "br":
+            cond = instr["args"][0]
+            then, els = (index[label] for label in instr["labels"])
+            return lambda env: then if env[cond] else els
+        if instr.get("args", []):
+            arg = instr["args"][0]
+
+            def ret(env):
+                env[RET] = env[arg]
+                return -1
+
+            return ret
+        return self.compile_goto(-1)
+
+    def compile_instr(self, instr):
+        op = instr.get("op", None)
+        dest = instr.get("dest", None)
+        args = instr.get("args", [])
+        if op == "const":
+            value = instr["value"]
+            if instr["type"] == "float":
+                value = float(value)
+
+            def const(env):
+                env[dest] = value
+
+            return const
+        if op in INT_OPS or op == "div":
+            a, b = args
+            f = INT_OPS.get(op, div)
+
+            def int_op(env):
+                val = f(env[a], env[b])
+                env[dest] = val if INT_MIN <= val <= INT_MAX else wrap(val)
+
+            return int_op
+        if op in VALUE_OPS or op == "fdiv":
+            f = VALUE_OPS.get(op, fdiv)
+            if len(args) == 1:
+                (a,) = args
+
+                def unary_op(env):
+                    env[dest] = f(env[a])
+
+                return unary_op
+            a, b = args
+
+            def binary_op(env):
+                env[dest] = f(env[a], env[b])
+
+            return binary_op
+        if op == "print":
+            write = self.out.write
+
+            def print_op(env):
+                write(" ".join(value_to_str(env[arg]) for arg in args) + "\n")
+
+            return print_op
+        if op == "call":
+            (name,) = instr["funcs"]
+            call = self.call
+
+            def call_op(env):
+                val = call(name, [env[arg] for arg in args])
+                if dest is not None:
+                    env[dest] = val
+
+            return call_op
+        if op == "nop":
+            return lambda env: None
+        raise ValueError(f"Unsupported instruction: {instr}.")
+
+
+def run_prg(prg, args=(), out=None):
+    """
+    Runs `prg` with the arguments `args` given as text. Returns the number
+    of instructions run.
+    """
+    interp = Interpreter(prg, out)
+    interp.run(args)
+    return interp.count
+
+
+@click.command()
+@click.argument("args", nargs=-1)
+@click.option(
+    "-p",
+    "--profile",
+    is_flag=True,
+    help="Print the dynamic instruction count on stderr.",
+)
+@click.option(
+    "--passes",
+    default=None,
+    help="Also run the program optimized by these comma-separated passes (see "
+    "`opt.py`), checking that it prints the same, and compare the instruction "
+    "counts on stderr.",
+)
+def main(args, profile, passes):
+    """
+    Runs a `bril` program with the arguments ARGS.
+    """
+    from io import StringIO
+    import json
+    from utils import load_prg
+
+    prg = load_prg()
+    prg["functions"] = list(prg["functions"])
+    if passes is None:
+        count = run_prg(prg, args)
+        if profile:
+            print(f"total_dyn_inst: {count}", file=sys.stderr)
+        return
+    from opt import opt_prg, parse_passes
+
+    try:
+        passes = parse_passes(passes)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--passes")
+    opt = opt_prg(json.loads(json.dumps(prg)), passes)
+    out, opt_out = StringIO(), StringIO()
+    count = run_prg(prg, args, out)
+    opt_count = run_prg(opt, args, opt_out)
+    sys.stdout.write(out.getvalue())
+    change = (opt_count - count) / count if count else 0.0
+    print(f"total_dyn_inst: {count} -> {opt_count} ({change:+.1%})", file=sys.stderr)
+    if opt_out.getvalue() != out.getvalue():
+        print("Error: the optimized program prints something else.", file=sys.stderr)
+        sys.exit(1)
+    return
+
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(100_000)
+    main()
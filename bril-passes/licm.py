@@ -0,0 +1,281 @@
+#! /usr/bin/env python3
+
+import click
+from stats import count, stats_options
+
+# Pure operations that can fault are not hoisted, as the loop might not have
+# run them.
+OPS_THAT_FAULT = ("div",)
+
+
+def find_loops(cfg, idoms):
+    """
+    Natural loops of the CFG, as {header position: set of body positions}.
+    A back edge goes to a block dominating its source, and the loop of a
+    back edge is its header plus the blocks reaching its source without
+    going through the header. Loops with the same header are merged.
+    """
+    from dom import dominates
+
+    loops = dict()
+    for i, block in enumerate(cfg):
+        if idoms[i] is None:
+            continue
+        for succ in block["succs"]:
+            h = cfg.index[succ]
+            if not dominates(idoms, h, i):
+                continue
+            body = loops.setdefault(h, {h})
+            stack = [i]
+            while stack:
+                j = stack.pop()
+                if j in body:
+                    continue
+                body.add(j)
+                for pred in cfg.blocks[j]["preds"]:
+                    if idoms[cfg.index[pred]] is not None:
+                        stack.append(cfg.index[pred])
+    return loops
+
+
+def get_reaching(cfg, reaching, i, j, var):
+    """
+    Definitions of `var` reaching the instruction `j` of block `i`.
+    """
+    for k in reversed(range(j)):
+        if cfg.blocks[i]["instrs"][k].get("dest", None) == var:
+            return [(i, k)]
+    return [
+        (bi, bj)
+        for bi, bj in reaching.domain.to_set(reaching.ins[i])
+        if cfg.blocks[bi]["instrs"][bj]["dest"] == var
+    ]
+
+
+def find_hoistable(cfg, h, body):
+    """
+    Positions `(block, instr)` of the instructions of the loop with header
+    `h` that can be moved to its preheader, in an order that keeps
+    dependencies first.
+
+    An instruction is invariant if every argument is only defined out of the
+    loop, or once in the loop by an invariant instruction. It is hoisted if
+    it is pure, defines a variable that is defined nowhere else in the loop
+    and not live when entering it, if its block dominates the exits of the
+    loop after which the variable is live, and if the invariant instructions
+    it depends on are hoisted too.
+    """
+    from dataflow import reaching_defs, live_vars
+    from dom import get_idoms, dominates
+    from utils import has_side_effects
+
+    idoms = get_idoms(cfg)
+    reaching = reaching_defs(cfg)
+    live = live_vars(cfg)
+    loop_defs = dict()
+    for i in body:
+        for instr in cfg.blocks[i]["instrs"]:
+            if "dest" in instr:
+                loop_defs[instr["dest"]] = loop_defs.get(instr["dest"], 0) + 1
+
+    # Invariant instructions, in the order they were found, with the
+    # invariant instructions of the loop they depend on.
+    invariant = dict()
+    changed = True
+    while changed:
+        changed = False
+        for i in sorted(body):
+            for j, instr in enumerate(cfg.blocks[i]["instrs"]):
+                if (i, j) in invariant or "dest" not in instr:
+                    continue
+                if has_side_effects(instr) or instr["op"] in (*OPS_THAT_FAULT, "phi"):
+                    continue
+                deps = []
+                for arg in instr.get("args", []) if instr["op"] != "const" else []:
+                    defs = get_reaching(cfg, reaching, i, j, arg)
+                    inside = [d for d in defs if d[0] in body]
+                    if not inside:
+                        continue
+                    if len(defs) == 1 and defs[0] in invariant:
+                        deps.append(defs[0])
+                        continue
+                    break
+                else:
+                    invariant[(i, j)] = deps
+                    changed = True
+
+    # Exits of the loop, with the variables live after them.
+    exits = []
+    for i in body:
+        for succ in cfg.blocks[i]["succs"]:
+            if cfg.index[succ] not in body:
+                exits.append((i, live.ins[cfg.index[succ]]))
+    hoisted = dict()
+    for (i, j), deps in invariant.items():
+        dest = cfg.blocks[i]["instrs"][j]["dest"]
+        bit = live.domain.bit(dest) if dest in live.domain.index else 0
+        if loop_defs[dest] > 1 or live.ins[h] & bit:
+            continue
+        if any(bits & bit and not dominates(idoms, i, e) for e, bits in exits):
+            continue
+        if all(dep in hoisted for dep in deps):
+            hoisted[(i, j)] = True
+    return list(hoisted)
+
+
+def split_header_phis(cfg, h, body, label, new_name):
+    """
+    `phi`s of the header `h` of the loop `body` once the edges entering the
+    loop go to the preheader `label`, and the `phi`s to place in the
+    preheader. The arguments of a header `phi` coming from out of the loop
+    become one argument from the preheader, merged by a new `phi` of the
+    preheader, named by `new_name`, if they differ.
+    """
+    outside = {pred for pred in cfg.blocks[h]["preds"] if cfg.index[pred] not in body}
+    header_instrs = []
+    pre_phis = []
+    for instr in cfg.blocks[h]["instrs"]:
+        if instr.get("op", None) != "phi":
+            header_instrs.append(instr)
+            continue
+        entries = list(zip(instr["args"], instr["labels"]))
+        inside = [(arg, pred) for arg, pred in entries if pred not in outside]
+        entering = [(arg, pred) for arg, pred in entries if pred in outside]
+        if not entering:
+            header_instrs.append(instr)
+            continue
+        if len({arg for arg, _ in entering}) == 1:
+            arg = entering[0][0]
+        else:
+            arg = new_name("licm.phi")
+            pre_phis.append(
+                dict(
+                    op="phi",
+                    dest=arg,
+                    type=instr["type"],
+                    args=[arg for arg, _ in entering],
+                    labels=[pred for _, pred in entering],
+                )
+            )
+        instr = dict(instr)
+        instr["args"] = [arg for arg, _ in inside] + [arg]
+        instr["labels"] = [pred for _, pred in inside] + [label]
+        header_instrs.append(instr)
+    return header_instrs, pre_phis
+
+
+def insert_preheader(cfg, h, body, hoisted, label, new_name):
+    """
+    New CFG where the instructions at positions `hoisted` are moved, in
+    order, to a preheader `label` placed before the header `h` of the loop
+    `body`. The edges entering the loop go to the preheader, and so do the
+    header `phi`s arguments coming from them (see `split_header_phis`).
+    """
+    from cfg import CFG, TERMINATORS
+
+    header = cfg.blocks[h]["name"]
+    header_instrs, pre_phis = split_header_phis(cfg, h, body, label, new_name)
+    moved = set(hoisted)
+    instrs = []
+    for i, block in enumerate(cfg):
+        block_instrs = block["instrs"] if i != h else header_instrs
+        if i == h:
+            if i > 0 and i - 1 in body:
+                last = instrs[-1] if instrs else {}
+                if last.get("op", None) not in TERMINATORS:
+                    # The loop block before the header must not fall into the
+                    # preheader.
+                    instrs.append(dict(op="jmp", labels=[header]))
+            instrs.append(dict(label=label))
+            instrs += pre_phis
+            instrs += [cfg.blocks[bi]["instrs"][bj] for bi, bj in hoisted]
+        block_instrs = [
+            instr for j, instr in enumerate(block_instrs) if (i, j) not in moved
+        ]
+        last = block_instrs[-1] if block_instrs else {}
+        if (
+            i not in body
+            and header in last.get("labels", [])
+            and last.get("op", None) in ("br", "jmp")
+        ):
+            last = dict(last)
+            last["labels"] = [
+                label if target == header else target for target in last["labels"]
+            ]
+            block_instrs[-1] = last
+        instrs += block_instrs
+    new_cfg, _ = CFG.from_instrs(instrs)
+    return new_cfg
+
+
+def licm_cfg(cfg):
+    """
+    Hoists the loop-invariant instructions of every natural loop into a new
+    preheader, inner loops first, so that the instructions hoisted out of an
+    inner loop can be hoisted again out of the outer one. Returns the new
+    CFG.
+    """
+    from cfg import is_label
+    from dom import get_idoms
+    from ssa import get_names, fresh_name
+
+    names = get_names(cfg.get_instrs())
+    nums = dict()
+    done = set()
+    while True:
+        loops = find_loops(cfg, get_idoms(cfg))
+        todo = [
+            (len(body), h)
+            for h, body in loops.items()
+            if cfg.blocks[h]["name"] not in done
+            and cfg.blocks[h]["instrs"]
+            and is_label(cfg.blocks[h]["instrs"][0])
+        ]
+        if not todo:
+            return cfg
+        _, h = min(todo)
+        done.add(cfg.blocks[h]["name"])
+        count("licm.loops")
+        hoisted = find_hoistable(cfg, h, loops[h])
+        if hoisted:
+            label = fresh_name("licm.pre", names, nums)
+            cfg = insert_preheader(
+                cfg,
+                h,
+                loops[h],
+                hoisted,
+                label,
+                lambda name: fresh_name(name, names, nums),
+            )
+            count("licm.hoisted", len(hoisted))
+
+
+def licm_fn(fn):
+    fn["cfg"] = licm_cfg(fn["cfg"])
+    return fn
+
+
+def licm_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
+
+    fn_pass = partial(run_on_cfg, licm_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="licm")
+
+
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
+
+    binary = is_binary_input()
+    prg = load_prg()
+    prg = licm_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,49 @@
 #! /usr/bin/env python3
 
-from dataclasses import dataclass, field
+import click
+from stats import count, stats_options
 from typing import Sequence
-from collections import defaultdict
-from utils import get_instr_type, InstrType, commutes
+from collections import Counter
+from utils import get_instr_type, InstrType, commutes, has_side_effects
 from utils import is_sequence_but_not_string
 
 
 class LVNTable:
     def __init__(
         self,
+        body=(),
+        fold=None,
     ):
         # [((op, *args), canonical_var)]
         self.table: list[tuple[tuple[str, Sequence[int]], str]] = []
+        # {(op, *args): valn}, kept in sync with `self.table`.
+        self.val2valn_map: dict = dict()
+        # Variables of the emitted body to value numbers. Every emitted
+        # variable is assigned once, so the map never goes stale.
         self.var2valn_map: dict = dict()
-        self.defs: list = []
+        # Variables of the input body to the emitted variable holding their
+        # current value.
+        self.src2var: dict = dict()
+        self.defs: set = set()
         self.body: list = []
-        self.prefix: defaultdict = defaultdict(int)
+        self.types: dict = dict()
         self.globvars: set = set()
-        self.glob2local: dict = dict()
+        # Definitions still to come for each variable, to know whether the
+        # current one is going to be overwritten and needs a new name.
+        self.ndefs: Counter = Counter(
+            instr["dest"] for instr in body if "dest" in instr
+        )
+        self.names: set = set(self.ndefs)
+        for instr in body:
+            self.names.update(instr.get("args", []))
+        self.nnames: int = 0
+        # Folding of an instruction given the table, called on value and
+        # control instructions as they are numbered (see `cfold.cfold_instr`).
+        self.fold = fold
+        self.nfolds: int = 0
+        # Value lookups, and how many found an existing value.
+        self.nlookups: int = 0
+        self.nhits: int = 0
         return
 
     # Utilities to generate values.
@@ -35,7 +60,11 @@ class LVNTable:
         if op == "const":
             return ["const", instr["type"], instr["value"]]
 
-        args = self.var2valn(instr["args"])
+        args = self.var2valn(instr.get("args", []))
+        if has_side_effects(instr):
+            # The table size makes the value unique, so that it is never
+            # reused by a later instruction.
+            return [instr["op"], *instr.get("funcs", []), *args, len(self.table)]
         if commutes(instr):
             args.sort()
 
@@ -44,20 +73,24 @@ class LVNTable:
     # Utilities to access the table.
 
     def var2valn(self, var):
+        if isinstance(var, str):
+            return self.var2valn_map[var]
         if is_sequence_but_not_string(var):
             return [self.var2valn_map[x] for x in var]
         return self.var2valn_map[var]
 
     def valn2var(self, valn):
+        if isinstance(valn, int):
+            return self.table[valn][-1]
         if is_sequence_but_not_string(valn):
             return [self.table[x][-1] for x in valn]
         return self.table[valn][-1]
 
     def find_val(self, val):
-        for i, (tval, tvar) in enumerate(self.table):
-            if tval == val:
-                return i
-        return None
+        valn = self.val2valn_map.get(tuple(val), None)
+        self.nlookups += 1
+        self.nhits += valn is not None
+        return valn
 
     def find_instr(self, instr):
         val = self.build_val(instr)
@@ -66,87 +99,101 @@ class LVNTable:
 
     # Utilities to modify the table.
 
+    def add_val(self, val, var):
+        self.table.append([val, var])
+        idx = len(self.table) - 1
+        self.val2valn_map[tuple(val)] = idx
+        return idx
+
     def add_instr_to_table(self, instr):
-        idx = self.find_instr(instr)
+        val = self.build_val(instr)
+        idx = self.find_val(val)
         if idx is None:
-            val = self.build_val(instr)
-            self.table.append([val, instr["dest"]])
-            idx = len(self.table) - 1
+            idx = self.add_val(val, instr["dest"])
         self.var2valn_map[instr["dest"]] = idx
         return idx
 
     def add_instr(self, instr):
-        instr_type = get_instr_type(instr)
-        if instr_type in (InstrType.LABEL, InstrType.EFFECT, InstrType.CTRL):
-            return None
-        if instr_type not in (InstrType.VALUE, InstrType.CONST):
-            raise ValueError(f"Invalid instruction: {instr}.")
+        """
+        Adds the value computed by `instr` to the table. `instr` must already
+        use the emitted variables as arguments (see `rename_args`).
+
+        The destination keeps its name only if this is its last definition
+        in the block and it was not read before being defined here.
+        Otherwise, it gets a new name, so that emitted variables are
+        assigned only once and the instructions already emitted never need
+        to be revisited.
+        """
+        dest = instr["dest"]
+        self.ndefs[dest] -= 1
+        if self.ndefs[dest] > 0 or dest in self.globvars:
+            instr["dest"] = self.new_name(dest)
+        self.defs.add(dest)
+        self.src2var[dest] = instr["dest"]
+        self.types[instr["dest"]] = instr.get("type", None)
+        return self.add_instr_to_table(instr)
 
-        globvars = self.get_globvars(instr)
-        for v in globvars.difference(self.globvars):
-            self.add_globvar(v)
+    def rename_args(self, instr):
+        new_instr = dict(instr)
         if "args" in instr:
-            instr["args"] = [
-                self.glob2local[v] if v in self.globvars else v for v in instr["args"]
-            ]
-
-        dest = instr["dest"]
-        if dest in self.defs:
-            # Rename old variables.
-            new_name = self.new_name(dest)
-            while new_name in self.defs:
-                new_name = self.new_name(dest)
-            # Table.
-            valn = self.var2valn(dest)
-            if self.table[valn][-1] == dest:
-                self.table[valn][-1] = new_name
-            self.var2valn_map[new_name] = self.var2valn(dest)
-            for i, _instr in enumerate(self.body):
-                if _instr.get("dest", None) == dest:
-                    self.body[i]["dest"] = new_name
-                if dest in _instr.get("args", []):
-                    self.body[i]["args"] = [
-                        (new_name if arg == dest else arg) for arg in _instr["args"]
-                    ]
-            if dest in self.glob2local:
-                self.glob2local[dest] = new_name
-        elif dest in self.globvars:
-            # New name.
-            new_name = self.new_name(dest)
-            while new_name in self.defs:
-                new_name = self.new_name(dest)
-            self.defs.append(new_name)
-            instr["dest"] = new_name
-            self.glob2local[dest] = new_name
-        else:
-            self.defs.append(dest)
+            new_instr["args"] = [self.get_var(v) for v in instr["args"]]
+        return new_instr
 
-        return self.add_instr_to_table(instr)
+    def get_var(self, v):
+        if v not in self.src2var:
+            self.add_globvar(v)
+        return self.src2var[v]
 
-    # Renaming of variables previously defined.
+    # Renaming of variables that are overwritten.
 
     def new_name(self, var):
-        name = f"lvn.{self.prefix[var]}"
-        self.prefix[var] += 1
+        name = f"lvn.{self.nnames}"
+        self.nnames += 1
+        while name in self.names:
+            name = f"lvn.{self.nnames}"
+            self.nnames += 1
+        self.names.add(name)
         return name
 
     # Global variables utilities.
 
-    def get_globvars(self, instr):
-        is_globvar = lambda v: v not in self.defs
-        return set(v for v in instr.get("args", []) if is_globvar(v))
-
     def add_globvar(self, v):
         val = ["globval", v]
         idx = self.find_val(val)
         if idx is None:
-            self.table.append([val, v])
-            idx = len(self.table) - 1
-            self.glob2local[v] = v
+            idx = self.add_val(val, v)
             self.globvars.add(v)
         self.var2valn_map[v] = idx
+        self.src2var[v] = v
         return idx
 
+    def get_glob_updates(self):
+        """
+        Copies of the last local value of the global variables redefined in
+        the block, to be placed at the end of the block.
+        """
+        updates = []
+        for v, var in self.src2var.items():
+            if v in self.globvars and var != v:
+                vtype = self.types[var]
+                var = self.valn2var(self.var2valn(var))
+                updates.append(dict(op="id", dest=v, type=vtype, args=[var]))
+        # The copies happen all at once: a global variable read by a copy
+        # after being updated by another one is saved first.
+        updated = {instr["dest"]: instr["type"] for instr in updates}
+        saved = dict()
+        for instr in updates:
+            arg = instr["args"][0]
+            if arg in updated:
+                if arg not in saved:
+                    saved[arg] = self.new_name(arg)
+                instr["args"] = [saved[arg]]
+        saves = [
+            dict(op="id", dest=var, type=updated[arg], args=[arg])
+            for arg, var in saved.items()
+        ]
+        return saves + updates
+
     # Instruction generation starting from the table.
 
     def build_ctrl_instr(self, instr):
@@ -155,25 +202,32 @@ class LVNTable:
 
         new_instr = dict(instr)
         if instr["op"] == "br":
-            condition = instr["args"][0]
+            new_instr["args"] = list(instr["args"])
+            condition = self.get_var(instr["args"][0])
             cond_valn = self.var2valn(condition)
             new_instr["args"][0] = self.valn2var(cond_valn)
         return new_instr
 
-    # FIXME
     def build_effect_instr(self, instr):
-        if instr.get("op", None) == "print":
-            valn = self.var2valn(instr["args"][0])
-            var = self.valn2var(valn)
-            instr["args"][0] = var
+        new_instr = self.rename_args(instr)
+        if "args" in new_instr:
+            new_instr["args"] = self.valn2var(self.var2valn(new_instr["args"]))
+        return new_instr
+
+    def fold_instr(self, instr):
+        instr, changed = self.fold(instr, self)
+        self.nfolds += changed
         return instr
 
     def build_value_instr(self, instr):
-        new_instr = dict(instr)
-        dest = new_instr["dest"]
-        idx = self.find_instr(instr)
+        new_instr = self.rename_args(instr)
+        if self.fold is not None:
+            new_instr = self.fold_instr(new_instr)
+            if new_instr["op"] == "const":
+                return self.build_const_instr(new_instr)
+        idx = self.add_instr(new_instr)
         var = self.table[idx][-1]
-        if dest == var:
+        if new_instr["dest"] == var:
             # For each argument, build the value and find the associated
             # canonical variable.
             new_instr["args"] = self.valn2var(self.var2valn(new_instr["args"]))
@@ -181,21 +235,20 @@ class LVNTable:
             # Returning an `id` operation to the canonical home of the value.
             new_instr["op"] = "id"
             new_instr["args"] = [var]
+            new_instr.pop("funcs", None)
         return new_instr
 
     def build_const_instr(self, instr):
         new_instr = dict(instr)
-        dest = new_instr["dest"]
-        idx = self.find_instr(instr)
+        idx = self.add_instr(new_instr)
         var = self.table[idx][-1]
-        if var != dest:
+        if var != new_instr["dest"]:
             new_instr["op"] = "id"
             new_instr["args"] = [var]
             del new_instr["value"]
         return new_instr
 
     def build_instr(self, instr):
-        self.add_instr(instr)
         instr_type = get_instr_type(instr)
         if instr_type == InstrType.LABEL:
             new_instr = instr
@@ -203,6 +256,8 @@ class LVNTable:
             new_instr = self.build_effect_instr(instr)
         elif instr_type == InstrType.CTRL:
             new_instr = self.build_ctrl_instr(instr)
+            if self.fold is not None:
+                new_instr = self.fold_instr(new_instr)
         elif instr_type == InstrType.CONST:
             new_instr = self.build_const_instr(instr)
         elif instr_type == InstrType.VALUE:
@@ -216,39 +271,66 @@ class LVNTable:
         return self.body
 
 
-def lvn_block(body):
-    lvn_table = LVNTable()
+def lvn_block(body, fold=None):
+    lvn_table = LVNTable(body, fold=fold)
     for instr in body:
         lvn_table.build_instr(instr)
     new_body = lvn_table.get_body()
-    # Updating global variables.
-    for v in lvn_table.globvars:
-        if lvn_table.glob2local[v] != v:
-            var = lvn_table.glob2local[v]
-            var = lvn_table.table[lvn_table.var2valn(var)][-1]
-            new_body.append(dict(op="id", dest=v, args=[var]))
+    # Updating global variables, before the terminator if there is one.
+    updates = lvn_table.get_glob_updates()
+    if updates:
+        if new_body and new_body[-1].get("op", None) in ("br", "jmp", "ret"):
+            term = dict(new_body.pop())
+            # The terminator must not see the updated values.
+            updated = {instr["dest"]: instr["type"] for instr in updates}
+            if any(arg in updated for arg in term.get("args", [])):
+                term["args"] = list(term["args"])
+                for i, arg in enumerate(term["args"]):
+                    if arg in updated:
+                        var = lvn_table.new_name(arg)
+                        new_body.append(
+                            dict(op="id", dest=var, type=updated[arg], args=[arg])
+                        )
+                        term["args"][i] = var
+            new_body += updates
+            new_body.append(term)
+        else:
+            new_body += updates
 
+    count("lvn.blocks")
+    count("lvn.table_size", len(lvn_table.table))
+    count("lvn.lookups", lvn_table.nlookups)
+    count("lvn.hits", lvn_table.nhits)
+    count("lvn.folds", lvn_table.nfolds)
     return new_body, lvn_table
 
 
-def lvn_prg(prg):
-    import cfg
+def lvn_fn(fn):
+    for i, block in enumerate(fn["cfg"]):
+        new_body, _ = lvn_block(block["instrs"])
+        fn["cfg"].update_block(i, new_body)
+    return fn
+
+
+def lvn_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
 
-    prg = cfg.get_cfg(prg)
-    for fn in prg["functions"]:
-        for block in fn["cfg"]:
-            block["instrs"], _ = lvn_block(block["instrs"])
-    prg = cfg.cfg2bril(prg)
-    return prg
+    fn_pass = partial(run_on_cfg, lvn_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="lvn")
 
 
-def main():
-    from utils import load_prg
-    import json
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
 
+    binary = is_binary_input()
     prg = load_prg()
-    prg = lvn_prg(prg)
-    print(json.dumps(prg))
+    prg = lvn_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
     return
 
 
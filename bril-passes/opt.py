@@ -0,0 +1,124 @@
+#! /usr/bin/env python3
+
+import click
+from stats import stats_options
+
+# Pass name -> (module, function, keyword arguments). Every function takes a
+# function carrying its CFG (see `cfg.get_cfg`) and returns it optimized,
+# without any I/O, so that passes can be chained in memory.
+PASSES = {
+    "lvn": ("lvn", "lvn_fn", dict()),
+    "cfold": ("cfold", "cfold_fn", dict()),
+    "idfold": ("idfold", "idfold_fn", dict()),
+    "sccp": ("sccp", "sccp_fn", dict()),
+    "unreachable": ("unreachable", "unreachable_fn", dict()),
+    "gvn": ("gvn", "gvn_fn", dict()),
+    "licm": ("licm", "licm_fn", dict()),
+    "to-ssa": ("ssa", "to_ssa_fn", dict()),
+    "from-ssa": ("ssa", "from_ssa_fn", dict()),
+    "tdce": ("tdce", "tdce_fn", dict(dead_defs=True, killed_defs=True)),
+    "tdce-dead-defs": ("tdce", "tdce_fn", dict(dead_defs=True)),
+    "tdce-killed-defs": ("tdce", "tdce_fn", dict(killed_defs=True)),
+    "tdce-live-defs": ("tdce", "tdce_fn", dict(live_defs=True)),
+}
+
+
+def get_pass(name):
+    from importlib import import_module
+    from functools import partial
+
+    module, fn, kwargs = PASSES[name]
+    return partial(getattr(import_module(module), fn), **kwargs)
+
+
+def parse_passes(passes):
+    names = [name.strip() for name in passes.split(",") if name.strip()]
+    for name in names:
+        if name not in PASSES:
+            raise ValueError(
+                f"Unknown pass: {name}. Available passes: {', '.join(PASSES)}."
+            )
+    return names
+
+
+def opt_fn(fn, passes):
+    from stats import timed_pass
+
+    for name in passes:
+        with timed_pass(name, fn):
+            fn = get_pass(name)(fn)
+    return fn
+
+
+def opt_fn_json(fn, passes):
+    from functools import partial
+    from cfg import run_on_cfg
+
+    # The CFG is formed once and flattened once, whatever the number of passes.
+    return run_on_cfg(partial(opt_fn, passes=passes), fn)
+
+
+def opt_prg(prg, passes, jobs=1, stats=None, cache=None):
+    from functools import partial
+    from utils import map_prg
+
+    fn_pass = partial(opt_fn_json, passes=passes)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, cache=cache)
+
+
+def open_cache(path, passes, max_mb=256):
+    """
+    Cache of the functions optimized by `passes` (see `cache.FnCache`). The
+    keyword arguments of the passes are part of the key, so that changing
+    what a pass name stands for does not reuse stale results.
+    """
+    from cache import FnCache
+
+    salt = ";".join(f"{name}{sorted(PASSES[name][2].items())}" for name in passes)
+    return FnCache(path, salt, max_bytes=max_mb << 20)
+
+
+@click.command()
+@click.option(
+    "--passes",
+    required=True,
+    help=f"Comma-separated passes to run in order, among: {', '.join(PASSES)}.",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    help="Read, optimize and write one function at a time.",
+)
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Reuse the functions already optimized by the same passes, cached here.",
+)
+@click.option("--cache-size", default=256, help="Size of the cache in MB.")
+@stats_options
+def main(passes, stream, jobs, cache_dir, cache_size, stats):
+    from functools import partial
+    from utils import load_prg, dump_prg, stream_prg, is_binary_input
+
+    try:
+        passes = parse_passes(passes)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--passes")
+    cache = None
+    if cache_dir is not None:
+        cache = open_cache(cache_dir, passes, cache_size)
+    if stream:
+        fn_pass = partial(opt_fn_json, passes=passes)
+        stream_prg(fn_pass, jobs=jobs, stats=stats, cache=cache)
+        return
+    binary = is_binary_input()
+    prg = load_prg()
+    prg = opt_prg(prg, passes, jobs=jobs, stats=stats, cache=cache)
+    dump_prg(prg, binary)
+    return
+
+
+if __name__ == "__main__":
+    main()
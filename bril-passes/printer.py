@@ -0,0 +1,72 @@
+#! /usr/bin/env python3
+
+import click
+
+
+def type_to_str(type_):
+    if isinstance(type_, dict):
+        ((ptr, inner),) = type_.items()
+        return f"{ptr}<{type_to_str(inner)}>"
+    return type_
+
+
+def value_to_str(type_, value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if type_ == "char":
+        return f"'{value}'"
+    return str(value)
+
+
+def instr_to_str(instr):
+    """
+    Textual `bril` of an instruction, as printed by `bril2txt`.
+    """
+    if "label" in instr:
+        return f".{instr['label']}:"
+    op = instr["op"]
+    if op == "const":
+        rhs = f"const {value_to_str(instr['type'], instr['value'])}"
+    else:
+        rhs = " ".join(
+            [
+                op,
+                *(f"@{func}" for func in instr.get("funcs", [])),
+                *instr.get("args", []),
+                *(f".{label}" for label in instr.get("labels", [])),
+            ]
+        )
+    if "dest" in instr:
+        return f"{instr['dest']}: {type_to_str(instr['type'])} = {rhs}"
+    return rhs
+
+
+def fn_to_str(fn):
+    lines = []
+    args = ", ".join(
+        f"{arg['name']}: {type_to_str(arg['type'])}" for arg in fn.get("args", [])
+    )
+    ret = f": {type_to_str(fn['type'])}" if "type" in fn else ""
+    lines.append(f"@{fn['name']}({args}){ret} {{" if args else f"@{fn['name']}{ret} {{")
+    for instr in fn["instrs"]:
+        lines.append(
+            instr_to_str(instr) if "label" in instr else f"  {instr_to_str(instr)};"
+        )
+    lines.append("}")
+    return "\n".join(lines)
+
+
+@click.command()
+def main():
+    """
+    Prints a `bril` program as text.
+    """
+    from utils import load_prg
+
+    prg = load_prg()
+    print("\n".join(fn_to_str(fn) for fn in prg["functions"]))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#! /usr/bin/env python3
+
+import click
+from stats import count, stats_options
+
+# Value of a variable that is not constant. Variables that are not defined yet
+# (the top of the lattice) are missing from the environments.
+BOTTOM = object()
+
+
+def meet(envs):
+    """
+    Meet of the environments flowing into a block: a variable is constant if
+    it has the same constant value in every environment defining it.
+    """
+    if not envs:
+        return dict()
+    env = dict(envs[0])
+    for other in envs[1:]:
+        for var, val in other.items():
+            if var not in env:
+                env[var] = val
+            elif env[var] is not BOTTOM and (val is BOTTOM or env[var] != val):
+                env[var] = BOTTOM
+    return env
+
+
+def eval_instr(instr, env):
+    """
+    Constant value of the instruction given the constant values of the
+    variables in `env`, `BOTTOM` if it is not constant and `None` if it
+    reads a variable that is not defined yet.
+    """
+    from cfold import fold_consts, ABSORBING
+
+    op = instr["op"]
+    if op == "const":
+        return instr["value"]
+    if op == "call":
+        return BOTTOM
+    vals = [env.get(arg, None) for arg in instr.get("args", [])]
+    if op in ABSORBING and ABSORBING[op] in vals:
+        return ABSORBING[op]
+    if any(val is BOTTOM for val in vals):
+        return BOTTOM
+    if any(val is None for val in vals):
+        return None
+    if op == "id":
+        return vals[0]
+    val = fold_consts(op, vals)
+    return BOTTOM if val is None else val
+
+
+def transfer(instrs, env):
+    """
+    Runs the block `instrs` on the environment at its entry. Returns the
+    environment at its exit and the branch condition it ends with, if any.
+    """
+    env = dict(env)
+    for instr in instrs:
+        if "dest" in instr:
+            val = eval_instr(instr, env)
+            if val is None:
+                env.pop(instr["dest"], None)
+            else:
+                env[instr["dest"]] = val
+    last = instrs[-1] if instrs else {}
+    if last.get("op", None) == "br":
+        return env, env.get(last["args"][0], BOTTOM)
+    return env, BOTTOM
+
+
+def get_exec_succs(block, cond):
+    """
+    Successors of `block` reached when its branch condition is `cond`.
+    """
+    last = block["instrs"][-1] if block["instrs"] else {}
+    if last.get("op", None) == "br" and "labels" in last and isinstance(cond, bool):
+        return [last["labels"][0] if cond else last["labels"][1]]
+    return block["succs"]
+
+
+def sccp_cfg(cfg, args=()):
+    """
+    Sparse conditional constant propagation: constants are propagated across
+    blocks along the edges that can be taken only, so that a branch on a
+    constant does not let the values of the dead side reach the join. A
+    single worklist run, in reverse postorder, finds the constant variables
+    and the executable blocks.
+
+    Variables are constant where they have a single possible value. Values
+    defined by constants, copies and the operations folded by `cfold` are
+    propagated. Function arguments and call results are not constant.
+
+    Returns the environments at the entry of the executable blocks, by
+    position, and the condition of their branch.
+    """
+    from heapq import heappush, heappop
+
+    order = cfg.reverse_postorder()
+    rank = {i: k for k, i in enumerate(order)}
+    # Environments at the entry and at the exit of the executable blocks.
+    ins = dict()
+    outs = dict()
+    conds = dict()
+    # Executable edges into every block.
+    exec_preds = {i: set() for i in range(len(cfg))}
+    worklist = [rank[0]]
+    queued = {0}
+    while worklist:
+        i = order[heappop(worklist)]
+        queued.discard(i)
+        block = cfg.blocks[i]
+        envs = [outs[j] for j in sorted(exec_preds[i])]
+        if i == 0:
+            envs.append({arg: BOTTOM for arg in args})
+        ins[i] = meet(envs)
+        env, cond = transfer(block["instrs"], ins[i])
+        if i in outs and outs[i] == env and conds[i] == cond:
+            continue
+        outs[i] = env
+        conds[i] = cond
+        for succ in get_exec_succs(block, cond):
+            j = cfg.index[succ]
+            exec_preds[j].add(i)
+            if j not in queued:
+                queued.add(j)
+                heappush(worklist, rank[j])
+    return ins, conds
+
+
+def sccp_fn(fn):
+    """
+    Replaces the constant definitions with constants, turns the branches on
+    constant conditions into jumps and removes the blocks that cannot be
+    reached.
+    """
+    cfg = fn["cfg"]
+    args = [arg["name"] for arg in fn.get("args", [])]
+    ins, conds = sccp_cfg(cfg, args)
+    unreachable = {i for i in range(len(cfg)) if i not in ins}
+    for i, env in ins.items():
+        block = cfg.blocks[i]
+        instrs = []
+        changed = False
+        for instr in block["instrs"]:
+            if "dest" in instr:
+                val = eval_instr(instr, env)
+                if val is None:
+                    env.pop(instr["dest"], None)
+                else:
+                    env[instr["dest"]] = val
+                if (
+                    val is not None
+                    and val is not BOTTOM
+                    and instr["op"] not in ("const", "call")
+                ):
+                    instr = dict(
+                        op="const", dest=instr["dest"], type=instr["type"], value=val
+                    )
+                    changed = True
+                    count("sccp.consts")
+            instrs.append(instr)
+        last = instrs[-1] if instrs else {}
+        if (
+            last.get("op", None) == "br"
+            and "labels" in last
+            and isinstance(conds[i], bool)
+        ):
+            labels = last["labels"]
+            instrs[-1] = dict(op="jmp", labels=[labels[0] if conds[i] else labels[1]])
+            changed = True
+            count("sccp.branches")
+        if changed:
+            cfg.update_block(i, instrs)
+    if unreachable:
+        cfg.remove_blocks(unreachable)
+        count("sccp.unreachable", len(unreachable))
+    return fn
+
+
+def sccp_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
+
+    fn_pass = partial(run_on_cfg, sccp_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="sccp")
+
+
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
+
+    binary = is_binary_input()
+    prg = load_prg()
+    prg = sccp_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
+    return
+
+
+if __name__ == "__main__":
+    main()
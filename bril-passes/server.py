@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+
+import asyncio
+import click
+from client import DEFAULT_SOCKET
+
+
+def load_passes():
+    """
+    Imports every pass module, so that requests never wait for an import.
+    """
+    from importlib import import_module
+    from opt import PASSES
+
+    for module, _, _ in PASSES.values():
+        import_module(module)
+    import cfg, dataflow, dom  # noqa: F401
+
+    return
+
+
+def optimize(data, passes, stats=False):
+    """
+    Optimizes the program `data`, in JSON or in binary (see `binfmt`), with
+    `passes` (comma-separated). Returns the optimized program in the same
+    form, and the stats summary or `None`.
+    """
+    from io import BytesIO
+    import json
+    from binfmt import is_binary, read_prg, write_prg
+    from opt import opt_prg, parse_passes
+    from stats import Stats
+
+    binary = is_binary(data)
+    prg = read_prg(BytesIO(data)) if binary else json.loads(data)
+    collector = Stats() if stats else None
+    prg = opt_prg(prg, parse_passes(passes), stats=collector)
+    summary = collector.summary() if collector is not None else None
+    if not binary:
+        return (json.dumps(prg) + "\n").encode(), summary
+    out = BytesIO()
+    write_prg(prg, out)
+    return out.getvalue(), summary
+
+
+class Server:
+    """
+    Optimizer serving the requests of `client.py` on a Unix domain socket.
+    Each request is optimized in a pool of `jobs` processes, which have the
+    passes loaded once and for all, so that concurrent clients do not wait
+    for each other.
+    """
+
+    def __init__(self, path, jobs=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.path: str = path
+        self.pool = ProcessPoolExecutor(jobs, initializer=load_passes)
+        self.nrequests: int = 0
+        return
+
+    async def handle(self, reader, writer):
+        import json
+
+        line = await reader.readline()
+        if not line:
+            # Only checking that a server is listening (see `claim_path`).
+            writer.close()
+            return
+        try:
+            header = json.loads(line)
+            data = await reader.read()
+            loop = asyncio.get_running_loop()
+            out, summary = await loop.run_in_executor(
+                self.pool, optimize, data, header["passes"], header.get("stats", False)
+            )
+            header = dict(ok=True, stats=summary)
+        except Exception as e:
+            # Bad passes, bad program or a pass failing: reported to the
+            # client, the server keeps serving.
+            out = b""
+            header = dict(ok=False, error=f"{type(e).__name__}: {e}")
+        self.nrequests += 1
+        try:
+            writer.write(json.dumps(header).encode() + b"\n")
+            writer.write(out)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        return
+
+    def claim_path(self):
+        """
+        Removes the socket left behind at `self.path` by a server that did
+        not shut down. Raises `FileExistsError` if a server is listening on
+        it.
+        """
+        import os
+        import socket
+        import stat
+
+        if not os.path.exists(self.path) or not stat.S_ISSOCK(
+            os.stat(self.path).st_mode
+        ):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.path)
+            except OSError:
+                os.unlink(self.path)
+                return
+        raise FileExistsError(f"A server is already listening on {self.path}.")
+
+    async def serve(self):
+        import os
+        import signal
+        from contextlib import suppress
+
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        # The socket is only removed at the end if it is still this one.
+        st = os.stat(self.path)
+        owned = (st.st_dev, st.st_ino)
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+
+        def request_stop():
+            if not stop.done():
+                stop.set_result(None)
+
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, request_stop)
+        try:
+            async with server:
+                await stop
+        finally:
+            with suppress(FileNotFoundError):
+                st = os.stat(self.path)
+                if (st.st_dev, st.st_ino) == owned:
+                    os.unlink(self.path)
+            self.pool.shutdown(cancel_futures=True)
+        return
+
+
+@click.command()
+@click.option(
+    "--socket",
+    "path",
+    type=click.Path(dir_okay=False),
+    default=DEFAULT_SOCKET,
+    show_default=True,
+    help="Unix domain socket to listen on.",
+)
+@click.option(
+    "--jobs",
+    default=None,
+    type=int,
+    help="Processes optimizing programs in parallel (one per CPU by default).",
+)
+def main(path, jobs):
+    """
+    Serves optimization requests from `client.py` until interrupted.
+    """
+    import sys
+
+    server = Server(path, jobs)
+    try:
+        server.claim_path()
+    except FileExistsError as e:
+        server.pool.shutdown()
+        raise click.ClickException(str(e))
+    # Starting the workers now, so that the first request does not pay for it.
+    server.pool.submit(load_passes).result()
+    print(f"Listening on {path}.", file=sys.stderr)
+    asyncio.run(server.serve())
+    print(f"Served {server.nrequests} requests.", file=sys.stderr)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+#! /usr/bin/env python3
+
+import click
+from stats import count, stats_options
+
+# Argument of a `phi` for the predecessors where the variable is not defined.
+UNDEFINED = "__undefined"
+# Values given to undefined `phi` arguments out of SSA form, so that the
+# copies of the `phi`s never read an undefined variable.
+UNDEFINED_VALUES = {"int": 0, "bool": False, "float": 0.0}
+
+
+def get_names(instrs, args=()):
+    names = set(args)
+    for instr in instrs:
+        if "dest" in instr:
+            names.add(instr["dest"])
+        if "label" in instr:
+            names.add(instr["label"])
+        names.update(instr.get("args", []))
+    return names
+
+
+def fresh_name(name, names, nums):
+    """
+    New name `{name}.{n}` not in `names`, with `n` counted per name in
+    `nums`.
+    """
+    while True:
+        nums[name] = nums.get(name, -1) + 1
+        new_name = f"{name}.{nums[name]}"
+        if new_name not in names:
+            names.add(new_name)
+            return new_name
+
+
+def prepare_cfg(cfg, names):
+    """
+    CFG ready for SSA: every block is labelled, so that `phi`s can name
+    their predecessors, the entry block has no predecessors, so that it
+    needs no `phi`s, and unreachable blocks are removed, as they would have
+    no definitions to read.
+    """
+    from cfg import CFG, is_label
+
+    nums = dict()
+    instrs = []
+    if cfg.blocks[0]["preds"]:
+        instrs.append(dict(label=fresh_name("ssa.entry", names, nums)))
+    for block in cfg:
+        if not block["instrs"] or not is_label(block["instrs"][0]):
+            instrs.append(dict(label=fresh_name("ssa.b", names, nums)))
+        instrs += block["instrs"]
+    cfg, _ = CFG.from_instrs(instrs)
+    cfg.remove_unreachable()
+    return cfg
+
+
+def to_ssa_cfg(cfg, args=()):
+    """
+    Converts the CFG of a function with arguments `args` (name and type
+    pairs) to SSA form. Returns the new CFG.
+
+    `phi`s are placed on the iterated dominance frontiers of the definitions
+    of every variable, only where the variable is live (pruned SSA), then
+    variables are renamed during a walk of the dominator tree. Arguments keep
+    their names.
+    """
+    from dataflow import live_vars
+    from dom import get_idoms, get_dom_tree, get_frontiers
+
+    names = get_names(cfg.get_instrs(), [name for name, _ in args])
+    cfg = prepare_cfg(cfg, names)
+    idoms = get_idoms(cfg)
+    children = get_dom_tree(idoms)
+    frontiers = get_frontiers(cfg, idoms)
+    live = live_vars(cfg)
+
+    # Blocks defining every variable, and its type.
+    def_blocks = dict()
+    types = dict(args)
+    for i, block in enumerate(cfg):
+        for instr in block["instrs"]:
+            if "dest" in instr:
+                def_blocks.setdefault(instr["dest"], set()).add(i)
+                types[instr["dest"]] = instr["type"]
+
+    # {block: {var: phi}}
+    phis = [dict() for _ in range(len(cfg))]
+    for var, blocks in def_blocks.items():
+        bit = live.domain.bit(var) if var in live.domain.index else 0
+        worklist = list(blocks)
+        while worklist:
+            i = worklist.pop()
+            for j in frontiers[i]:
+                if var in phis[j] or not live.ins[j] & bit:
+                    continue
+                phis[j][var] = dict(
+                    op="phi", dest=var, type=types[var], args=[], labels=[]
+                )
+                if j not in blocks:
+                    worklist.append(j)
+
+    # Renaming, with a stack of names per variable.
+    nums = dict()
+    stacks = {name: [name] for name, _ in args}
+    new_instrs = [None] * len(cfg)
+    # Variables renamed by every block, to pop their names when leaving it.
+    pushed = [[] for _ in range(len(cfg))]
+    todo = [(0, True)]
+    while todo:
+        i, entering = todo.pop()
+        if not entering:
+            for var in pushed[i]:
+                stacks[var].pop()
+            continue
+        block = cfg.blocks[i]
+        instrs = []
+        body = block["instrs"]
+        # The label stays first.
+        if body and "label" in body[0]:
+            instrs.append(body[0])
+            body = body[1:]
+        for var, phi in phis[i].items():
+            phi["dest"] = fresh_name(var, names, nums)
+            stacks.setdefault(var, []).append(phi["dest"])
+            pushed[i].append(var)
+            instrs.append(phi)
+        for instr in body:
+            instr = instr.copy()
+            if "args" in instr:
+                instr["args"] = [
+                    stacks[arg][-1] if stacks.get(arg) else arg for arg in instr["args"]
+                ]
+            if "dest" in instr:
+                var = instr["dest"]
+                instr["dest"] = fresh_name(var, names, nums)
+                stacks.setdefault(var, []).append(instr["dest"])
+                pushed[i].append(var)
+            instrs.append(instr)
+        for succ in block["succs"]:
+            for var, phi in phis[cfg.index[succ]].items():
+                phi["args"].append(stacks[var][-1] if stacks.get(var) else UNDEFINED)
+                phi["labels"].append(block["name"])
+        new_instrs[i] = instrs
+        todo.append((i, False))
+        todo += [(j, True) for j in reversed(children[i])]
+
+    for i, instrs in enumerate(new_instrs):
+        cfg.update_block(i, instrs)
+    count("ssa.phis", sum(len(block_phis) for block_phis in phis))
+    return cfg
+
+
+def phi_live_outs(cfg):
+    """
+    Variables live at the exit of every block, `phi` arguments being read at
+    the end of the predecessor they come from and `phi` destinations defined
+    at the start of their block.
+    """
+    from dataflow import Domain, block_uses_defs, solve
+
+    domain = Domain()
+    gen, kill, phi_defs = [], [], []
+    phi_uses = [0] * len(cfg)
+    for block in cfg:
+        phis = [instr for instr in block["instrs"] if instr.get("op", None) == "phi"]
+        uses, defs = block_uses_defs(
+            [instr for instr in block["instrs"] if instr.get("op", None) != "phi"]
+        )
+        gen.append(sum(domain.add(var) for var in set(uses)))
+        kill.append(sum(domain.add(var) for var in defs))
+        phi_defs.append(sum(domain.add(phi["dest"]) for phi in phis))
+        for phi in phis:
+            for arg, label in zip(phi["args"], phi["labels"]):
+                if arg != UNDEFINED and label in cfg.index:
+                    phi_uses[cfg.index[label]] |= domain.add(arg)
+
+    def transfer(i, bits):
+        return (gen[i] | ((bits | phi_uses[i]) & ~kill[i])) & ~phi_defs[i]
+
+    live = solve(cfg, transfer, domain, forward=False, meet="union")
+    return [set(domain.to_set(bits | phi_uses[i])) for i, bits in enumerate(live.outs)]
+
+
+def get_interference(cfg, args=()):
+    """
+    Interference graph of the variables of `cfg`, as {var: vars}: two
+    variables interfere when one is live where the other is defined. The
+    `phi`s of a block, and the arguments `args` of the function, define
+    their variables at once, so that they interfere with each other.
+    """
+    from itertools import combinations
+
+    graph = dict()
+
+    def add_edges(dest, live):
+        for var in live:
+            if var != dest:
+                graph.setdefault(dest, set()).add(var)
+                graph.setdefault(var, set()).add(dest)
+
+    for i, (block, live) in enumerate(zip(cfg, phi_live_outs(cfg))):
+        phis = []
+        for instr in reversed(block["instrs"]):
+            if instr.get("op", None) == "phi":
+                phis.append(instr["dest"])
+                continue
+            if "dest" in instr:
+                add_edges(instr["dest"], live)
+                live.discard(instr["dest"])
+            live.update(instr.get("args", []))
+        defs = phis + (list(args) if i == 0 else [])
+        for dest in defs:
+            add_edges(dest, live)
+        for a, b in combinations(defs, 2):
+            add_edges(a, [b])
+    return graph
+
+
+def coalesce_phis(cfg, names):
+    """
+    Names of the variables of `cfg` once the destination of every `phi` is
+    merged with its arguments, whenever none of the merged variables
+    interfere (see `get_interference`), as {var: name}. Merged variables
+    keep the name of the function argument among them, read but never
+    defined, or else take back the name they had before SSA (`x` for `x.3`,
+    see `fresh_name`) if it is free.
+    """
+    # `phi` arguments, leaving out those of removed predecessors.
+    phi_args = [
+        (instr["dest"], arg)
+        for block in cfg
+        for instr in block["instrs"]
+        if instr.get("op", None) == "phi"
+        for arg, label in zip(instr["args"], instr["labels"])
+        if arg != UNDEFINED and label in cfg.index
+    ]
+    read, defined = set(), set()
+    for instr in cfg.get_instrs():
+        if instr.get("op", None) != "phi":
+            read.update(instr.get("args", []))
+        if "dest" in instr:
+            defined.add(instr["dest"])
+    args = sorted(read.union(arg for _, arg in phi_args) - defined)
+    graph = get_interference(cfg, args)
+    # Variable -> its class, a set shared by the members of the class.
+    classes = dict()
+    for dest, arg in phi_args:
+        a = classes.setdefault(dest, {dest})
+        b = classes.setdefault(arg, {arg})
+        if a is b or any(graph.get(var, set()) & b for var in a):
+            continue
+        a |= b
+        for var in b:
+            classes[var] = a
+
+    renames = dict()
+    done = set()
+    for members in classes.values():
+        if id(members) in done or len(members) == 1:
+            continue
+        done.add(id(members))
+        name = next((arg for arg in args if arg in members), None)
+        for member in sorted(members) if name is None else ():
+            base, _, num = member.rpartition(".")
+            if base and num.isdigit() and base not in names:
+                name = base
+                names.add(name)
+                break
+        name = name or min(members)
+        renames.update((member, name) for member in members)
+    return renames
+
+
+def from_ssa_cfg(cfg):
+    """
+    Converts a CFG out of SSA form, replacing every `phi` with copies at the
+    end of the predecessors. The variables of a `phi` that do not interfere
+    are first given one name (see `coalesce_phis`), and the copies between
+    them dropped. Edges from blocks with several successors to blocks with
+    `phi`s are split, so that the copies only run on the edge they belong to.
+    The copies of an edge are done through temporaries when one of them
+    overwrites the argument of another. Returns the new CFG.
+    """
+    from cfg import CFG, TERMINATORS
+
+    names = get_names(cfg.get_instrs())
+    nums = dict()
+    renames = coalesce_phis(cfg, names)
+
+    def rename(instr):
+        if not any(
+            var in renames for var in [instr.get("dest"), *instr.get("args", [])]
+        ):
+            return instr
+        instr = dict(instr)
+        if "dest" in instr:
+            instr["dest"] = renames.get(instr["dest"], instr["dest"])
+        if "args" in instr:
+            instr["args"] = [renames.get(arg, arg) for arg in instr["args"]]
+        return instr
+
+    # Copies to add on every edge, as {(pred, succ): [(dest, type, arg)]}.
+    copies = dict()
+    for block in cfg:
+        for instr in block["instrs"]:
+            if instr.get("op", None) != "phi":
+                continue
+            instr = rename(instr)
+            for arg, label in zip(instr["args"], instr["labels"]):
+                if arg == UNDEFINED and instr["type"] not in UNDEFINED_VALUES:
+                    continue
+                if arg == instr["dest"]:
+                    count("ssa.coalesced")
+                    continue
+                copy = (instr["dest"], instr["type"], arg)
+                copies.setdefault((label, block["name"]), []).append(copy)
+
+    def build_copy(dest, type_, arg):
+        if arg == UNDEFINED:
+            return dict(
+                op="const", dest=dest, type=type_, value=UNDEFINED_VALUES[type_]
+            )
+        return dict(op="id", dest=dest, type=type_, args=[arg])
+
+    def build_copies(edge_copies):
+        dests = {dest for dest, _, _ in edge_copies}
+        if not any(arg in dests for _, _, arg in edge_copies):
+            return [build_copy(*copy) for copy in edge_copies]
+        tmps = [fresh_name("ssa.tmp", names, nums) for _ in edge_copies]
+        return [
+            build_copy(tmp, type_, arg)
+            for tmp, (_, type_, arg) in zip(tmps, edge_copies)
+        ] + [
+            build_copy(dest, type_, tmp)
+            for tmp, (dest, type_, _) in zip(tmps, edge_copies)
+        ]
+
+    instrs = []
+    for block in cfg:
+        body = [
+            rename(instr) for instr in block["instrs"] if instr.get("op", None) != "phi"
+        ]
+        succs = list(dict.fromkeys(block["succs"]))
+        term = []
+        if body and body[-1].get("op", None) in TERMINATORS:
+            term = [body.pop()]
+        splits = []
+        if len(succs) == 1:
+            body += build_copies(copies.get((block["name"], succs[0]), []))
+        else:
+            for succ in succs:
+                if (block["name"], succ) not in copies:
+                    continue
+                label = fresh_name("ssa.edge", names, nums)
+                term[0] = dict(term[0])
+                term[0]["labels"] = [
+                    label if target == succ else target for target in term[0]["labels"]
+                ]
+                splits.append(dict(label=label))
+                splits += build_copies(copies[(block["name"], succ)])
+                splits.append(dict(op="jmp", labels=[succ]))
+                count("ssa.split_edges")
+        instrs += body + term + splits
+    cfg, _ = CFG.from_instrs(instrs)
+    return cfg
+
+
+def to_ssa_fn(fn):
+    args = [(arg["name"], arg["type"]) for arg in fn.get("args", [])]
+    fn["cfg"] = to_ssa_cfg(fn["cfg"], args)
+    return fn
+
+
+def from_ssa_fn(fn):
+    fn["cfg"] = from_ssa_cfg(fn["cfg"])
+    return fn
+
+
+def ssa_prg(prg, fn_pass, jobs=1, stats=None, name=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
+
+    return map_prg(partial(run_on_cfg, fn_pass), prg, jobs=jobs, stats=stats, name=name)
+
+
+@click.command()
+@click.option("--from-ssa", is_flag=True, help="Convert out of SSA form instead.")
+@click.option("--roundtrip", is_flag=True, help="Convert to SSA form and back.")
+@click.option("--jobs", default=1, help="Processes converting functions in parallel.")
+@stats_options
+def main(from_ssa, roundtrip, jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
+
+    binary = is_binary_input()
+    prg = load_prg()
+    if not from_ssa:
+        prg = ssa_prg(prg, to_ssa_fn, jobs=jobs, stats=stats, name="to-ssa")
+    if from_ssa or roundtrip:
+        prg = ssa_prg(prg, from_ssa_fn, jobs=jobs, stats=stats, name="from-ssa")
+    dump_prg(prg, binary)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#! /usr/bin/env python3
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+# Record of the function being optimized, `None` when stats are disabled. A
+# context variable keeps concurrent optimizations (threads, asyncio tasks)
+# from mixing their records.
+current: ContextVar = ContextVar("stats", default=None)
+
+
+def count_instrs(fn):
+    instrs = fn["cfg"].get_instrs() if "cfg" in fn else fn["instrs"]
+    return sum(1 for instr in instrs if "label" not in instr)
+
+
+def count(key, n=1):
+    """
+    Adds `n` to the counter `key` of the pass running on the current
+    function. Does nothing when stats are disabled.
+    """
+    record = current.get()
+    if record is None:
+        return
+    counters = (
+        record["passes"][-1]["counters"] if record["passes"] else record["counters"]
+    )
+    counters[key] = counters.get(key, 0) + n
+    return
+
+
+@contextmanager
+def timed_pass(name, fn):
+    record = current.get()
+    if record is None:
+        yield
+        return
+    entry = dict(name=name, instrs_before=count_instrs(fn), counters=dict())
+    record["passes"].append(entry)
+    start = perf_counter()
+    yield
+    entry["time"] = perf_counter() - start
+    entry["instrs_after"] = count_instrs(fn)
+    return
+
+
+def run_fn(fn_pass, fn, name=None):
+    """
+    Runs `fn_pass` on `fn` recording its stats, timed as the pass `name` if
+    given. Returns the function and its record.
+    """
+    record = dict(
+        name=fn["name"], instrs_before=count_instrs(fn), passes=[], counters=dict()
+    )
+    token = current.set(record)
+    try:
+        start = perf_counter()
+        if name is None:
+            fn = fn_pass(fn)
+        else:
+            with timed_pass(name, fn):
+                fn = fn_pass(fn)
+        record["time"] = perf_counter() - start
+    finally:
+        current.reset(token)
+    record["instrs_after"] = count_instrs(fn)
+    return fn, record
+
+
+class Stats:
+    """
+    Stats of a whole run: wall time, instructions before/after, and per-pass
+    and per-function records with the counters reported by the passes
+    through `count`.
+    """
+
+    def __init__(self):
+        self.fns: list = []
+        self.start: float = perf_counter()
+        # Cache the functions went through, if any (see `cache.FnCache`).
+        # Functions found in the cache have no record.
+        self.cache = None
+        return
+
+    def map_fns(self, fn_pass, fns, jobs=1, name=None):
+        """
+        Same as `utils.map_fns`, recording the stats of every function.
+        """
+        from functools import partial
+        from utils import map_fns
+
+        for fn, record in map_fns(partial(run_fn, fn_pass, name=name), fns, jobs):
+            self.fns.append(record)
+            yield fn
+
+    def summary(self):
+        passes = dict()
+        for record in self.fns:
+            for entry in record["passes"]:
+                total = passes.setdefault(
+                    entry["name"],
+                    dict(time=0.0, instrs_before=0, instrs_after=0, counters=dict()),
+                )
+                total["time"] += entry["time"]
+                total["instrs_before"] += entry["instrs_before"]
+                total["instrs_after"] += entry["instrs_after"]
+                for key, n in entry["counters"].items():
+                    total["counters"][key] = total["counters"].get(key, 0) + n
+        for total in passes.values():
+            counters = total["counters"]
+            if counters.get("lvn.lookups", 0) > 0:
+                counters["lvn.hit_rate"] = (
+                    counters["lvn.hits"] / counters["lvn.lookups"]
+                )
+        summary = dict(
+            time=perf_counter() - self.start,
+            instrs_before=sum(record["instrs_before"] for record in self.fns),
+            instrs_after=sum(record["instrs_after"] for record in self.fns),
+            passes=passes,
+            functions=self.fns,
+        )
+        if self.cache is not None:
+            summary["cache"] = self.cache.summary()
+        return summary
+
+    def dump(self, path=None):
+        """
+        Writes the summary as JSON to `path`, or to stderr by default.
+        """
+        import json
+        import sys
+
+        if path is None:
+            json.dump(self.summary(), sys.stderr)
+            sys.stderr.write("\n")
+            return
+        with open(path, "w") as f:
+            json.dump(self.summary(), f)
+            f.write("\n")
+        return
+
+
+def stats_options(main):
+    """
+    Adds the `--stats` and `--stats-file` options to a command, passing it a
+    `stats` argument: a `Stats` object, or `None` when stats are disabled.
+    """
+    import click
+    from functools import wraps
+
+    @click.option(
+        "--stats", is_flag=True, help="Report optimization stats as JSON on stderr."
+    )
+    @click.option(
+        "--stats-file",
+        type=click.Path(dir_okay=False),
+        default=None,
+        help="Write the stats to this file instead of stderr.",
+    )
+    @wraps(main)
+    def wrapper(stats, stats_file, **kwargs):
+        collector = Stats() if stats or stats_file else None
+        ret = main(stats=collector, **kwargs)
+        if collector is not None:
+            collector.dump(stats_file)
+        return ret
+
+    return wrapper
@@ -1,34 +1,57 @@
 #! /usr/bin/env python3
 
 import click
+from stats import count, stats_options
 
-global_changed = False
 
+def find_dead_defs(body):
+    """
+    Positions of the definitions in `body` whose value is never used, also
+    counting the uses made only by other dead definitions.
 
-def dead_defs_pass(body):
+    Uses are counted once. Deleting a definition decrements the uses of its
+    arguments and a variable whose uses drop to zero puts its definitions
+    on the worklist, so the whole chain of dead definitions is found in a
+    single linear pass instead of one pass per link of the chain.
+    """
     from collections import defaultdict
+    from utils import has_side_effects
 
-    global global_changed
+    uses = defaultdict(int)
+    defs = defaultdict(list)
+    for i, instr in enumerate(body):
+        # Skip constant definitions.
+        # Using `get` to skip instructions that do not have an `op` field.
+        if instr.get("op", "const") != "const":
+            # Using `get` to skip instructions that do not have an `args` field.
+            for arg in instr.get("args", []):
+                uses[arg] += 1
+        # Calls must run even when their result is not used.
+        if "dest" in instr and not has_side_effects(instr):
+            defs[instr["dest"]].append(i)
 
-    changed = True
-    while changed:
-        to_delete = []
-        uses = defaultdict(int)
-        for instr in body:
-            # Skip constant definitions.
-            # Using `get` to skip instructions that do not have an `op` field.
-            if instr.get("op", "const") != "const":
-                # Using `get` to skip instructions that do not have an `args` field.
-                for arg in instr.get("args", []):
-                    uses[arg] += 1
-        for i, instr in enumerate(body):
-            if "dest" in instr and uses[instr["dest"]] == 0:
-                to_delete.append(i)
-        body = [instr for i, instr in enumerate(body) if i not in to_delete]
-        changed = len(to_delete) > 0
-        if changed:
-            global_changed = True
-    return body
+    worklist = [i for var, idxs in defs.items() if uses[var] == 0 for i in idxs]
+    dead = set()
+    while worklist:
+        i = worklist.pop()
+        dead.add(i)
+        instr = body[i]
+        if instr.get("op", "const") != "const":
+            for arg in instr.get("args", []):
+                uses[arg] -= 1
+                if uses[arg] == 0:
+                    worklist += defs[arg]
+    return dead
+
+
+def dead_defs_pass(body):
+    """
+    Returns the body without its dead definitions and whether it changed.
+    """
+    dead = find_dead_defs(body)
+    if dead:
+        body = [instr for i, instr in enumerate(body) if i not in dead]
+    return body, len(dead) > 0
 
 
 def killed_defs_block(body):
@@ -51,29 +74,124 @@ def killed_defs_block(body):
     - `a` has been defined before.
     - between the two definitions, `a` has not been used.
     Then, you can remove the first definition of `a`.
+
+    Returns the new body and whether it changed.
     """
     from collections import defaultdict
+    from utils import has_side_effects
 
-    global global_changed
-
+    body_changed = False
     changed = True
     while changed:
         uses = defaultdict(int)
         defs = {}
-        to_delete = []
+        to_delete = set()
         for i, instr in enumerate(body):
             if instr.get("op", "const") != "const":
                 for arg in instr.get("args", []):
                     uses[arg] += 1
             if "dest" in instr:
                 if instr["dest"] in defs and instr["dest"] not in uses:
-                    to_delete.append(defs[instr["dest"]])
-                defs[instr["dest"]] = i
+                    to_delete.add(defs[instr["dest"]])
+                if not has_side_effects(instr):
+                    defs[instr["dest"]] = i
+                else:
+                    defs.pop(instr["dest"], None)
         body = [instr for i, instr in enumerate(body) if i not in to_delete]
+        count("tdce.killed_defs", len(to_delete))
+        count("tdce.killed_defs_iterations")
         changed = len(to_delete) > 0
-        if changed:
-            global_changed = True
-    return body
+        body_changed |= changed
+    return body, body_changed
+
+
+def dead_defs_cfg(cfg):
+    """
+    Removes the dead definitions of a function. Returns the positions of the
+    blocks that changed.
+    """
+    dead = find_dead_defs(cfg.get_instrs())
+    count("tdce.dead_defs", len(dead))
+    changed = set()
+    start = 0
+    for i, block in enumerate(cfg):
+        end = start + len(block["instrs"])
+        if any(j in dead for j in range(start, end)):
+            instrs = [
+                instr for j, instr in enumerate(block["instrs"], start) if j not in dead
+            ]
+            cfg.update_block(i, instrs)
+            changed.add(i)
+        start = end
+    return changed
+
+
+def killed_defs_cfg(cfg, blocks=None):
+    """
+    Removes the killed definitions of the blocks at positions `blocks` (all
+    of them by default). Returns the positions of the blocks that changed.
+    """
+    if blocks is None:
+        blocks = range(len(cfg))
+    changed = set()
+    for i in sorted(blocks):
+        instrs, block_changed = killed_defs_block(cfg.blocks[i]["instrs"])
+        if block_changed:
+            cfg.update_block(i, instrs)
+            changed.add(i)
+    return changed
+
+
+def live_defs_cfg(cfg):
+    """
+    Removes every definition whose value is not used on any path from it,
+    uses by removed definitions not counting, in a single backward analysis
+    over the CFG: a variable is live below an instruction only if a kept
+    instruction reads it. This subsumes both dead and killed definitions,
+    across blocks too. Returns the positions of the blocks that changed.
+    """
+    from dataflow import Domain, solve
+    from utils import has_side_effects
+
+    domain = Domain()
+    # Instructions of every block, last first, as (dest, removable, args)
+    # bitsets.
+    summaries = []
+    for block in cfg:
+        summary = []
+        for instr in reversed(block["instrs"]):
+            dest = domain.add(instr["dest"]) if "dest" in instr else 0
+            args = 0
+            # Constants have no arguments to read.
+            if instr.get("op", "const") != "const":
+                for arg in instr.get("args", []):
+                    args |= domain.add(arg)
+            summary.append((dest, dest != 0 and not has_side_effects(instr), args))
+        summaries.append(summary)
+
+    def transfer(i, live):
+        for dest, removable, args in summaries[i]:
+            if removable and not live & dest:
+                continue
+            live = (live & ~dest) | args
+        return live
+
+    solution = solve(cfg, transfer, domain, forward=False, meet="union")
+    changed = set()
+    for i, block in enumerate(cfg):
+        live = solution.outs[i]
+        dead = set()
+        for j, (dest, removable, args) in enumerate(summaries[i]):
+            if removable and not live & dest:
+                dead.add(len(summaries[i]) - 1 - j)
+                continue
+            live = (live & ~dest) | args
+        if dead:
+            instrs = [instr for j, instr in enumerate(block["instrs"]) if j not in dead]
+            cfg.update_block(i, instrs)
+            changed.add(i)
+        count("tdce.live_defs", len(dead))
+    return changed
 
 
 def killed_defs_pass(prg):
@@ -81,37 +199,70 @@ def killed_defs_pass(prg):
 
     cfg = get_cfg(prg)
     for fn in cfg["functions"]:
-        for i, block in enumerate(fn["cfg"]):
-            fn["cfg"][i]["instrs"] = killed_defs_block(block["instrs"])
+        killed_defs_cfg(fn["cfg"])
     prg = cfg2bril(cfg)
     return prg
 
 
+def tdce_cfg(cfg, dead_defs=False, killed_defs=False, live_defs=False):
+    """
+    Runs the enabled eliminations on the CFG of a function until they
+    converge. Returns whether the function changed.
+
+    Both eliminations converge on their own, so one only needs to run again
+    after the other changed something: dead definitions are global to the
+    function, while killed definitions only need to be looked for again in
+    the blocks that lost instructions.
+
+    Live definitions remove everything the two others would in one run, so
+    they replace them when enabled.
+    """
+    if live_defs:
+        return len(live_defs_cfg(cfg)) > 0
+    changed = False
+    # Blocks whose killed definitions have not been removed yet.
+    todo = set(range(len(cfg))) if killed_defs else set()
+    rerun_dead_defs = dead_defs
+    while rerun_dead_defs or todo:
+        count("tdce.rounds")
+        if rerun_dead_defs:
+            blocks = dead_defs_cfg(cfg)
+            changed |= len(blocks) > 0
+            if killed_defs:
+                todo |= blocks
+        blocks = killed_defs_cfg(cfg, todo)
+        changed |= len(blocks) > 0
+        todo = set()
+        rerun_dead_defs = dead_defs and len(blocks) > 0
+    return changed
+
+
 def tdce_fn(fn, **kwargs):
-    if kwargs.get("dead_defs", False):
-        fn["instrs"] = dead_defs_pass(fn["instrs"])
+    tdce_cfg(
+        fn["cfg"],
+        dead_defs=kwargs.get("dead_defs", False),
+        killed_defs=kwargs.get("killed_defs", False),
+        live_defs=kwargs.get("live_defs", False),
+    )
     return fn
 
 
-def tdce_prg(prg, **kwargs):
-    prg["functions"] = [tdce_fn(fn, **kwargs) for fn in prg["functions"]]
-    if kwargs.get("killed_defs", False):
-        prg = killed_defs_pass(prg)
-    return prg
+def tdce_prg(prg, jobs=1, stats=None, **kwargs):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
 
+    fn_pass = partial(run_on_cfg, partial(tdce_fn, **kwargs))
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="tdce")
 
-def tdce(**kwargs):
-    from utils import load_prg
-    import json
 
-    global global_changed
+def tdce(jobs=1, stats=None, **kwargs):
+    from utils import load_prg, dump_prg, is_binary_input
 
+    binary = is_binary_input()
     prg = load_prg()
-    global_changed = True
-    while global_changed:
-        global_changed = False
-        prg = tdce_prg(prg, **kwargs)
-    print(json.dumps(prg))
+    prg = tdce_prg(prg, jobs=jobs, stats=stats, **kwargs)
+    dump_prg(prg, binary)
     return
 
 
@@ -119,8 +270,21 @@ def tdce(**kwargs):
 @click.option("--all-opts", is_flag=True)
 @click.option("--dead-defs", is_flag=True)
 @click.option("--killed-defs", is_flag=True)
-def main(all_opts, dead_defs, killed_defs):
-    tdce(dead_defs=dead_defs or all_opts, killed_defs=killed_defs or all_opts)
+@click.option(
+    "--live-defs",
+    is_flag=True,
+    help="Remove the definitions that are not live, from a global liveness analysis.",
+)
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(all_opts, dead_defs, killed_defs, live_defs, jobs, stats):
+    tdce(
+        jobs=jobs,
+        stats=stats,
+        dead_defs=dead_defs or all_opts,
+        killed_defs=killed_defs or all_opts,
+        live_defs=live_defs,
+    )
     return
 
 
@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+
+"""
+Regression checks of the batch mode. Run with `python -m unittest
+test_batch` from this directory.
+"""
+
+import unittest
+
+PRG = dict(
+    functions=[
+        dict(
+            name="main",
+            instrs=[
+                dict(op="const", dest="a", type="int", value=1),
+                dict(op="add", dest="b", type="int", args=["a", "a"]),
+                dict(op="print", args=["b"]),
+            ],
+        )
+    ]
+)
+
+
+class TestBatch(unittest.TestCase):
+    def test_rerun_glob(self):
+        """
+        Running a glob again over a directory holding the outputs of the
+        previous run only optimizes the inputs again.
+        """
+        import json
+        import os
+        from tempfile import TemporaryDirectory
+        from click.testing import CliRunner
+        from batch import main
+
+        with TemporaryDirectory() as tmp:
+            for name in ("p1", "p2"):
+                with open(os.path.join(tmp, f"{name}.json"), "w") as f:
+                    json.dump(PRG, f)
+            args = [os.path.join(tmp, "*.json"), "--passes", "lvn,tdce"]
+            for _ in range(2):
+                result = CliRunner().invoke(main, args)
+                self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(
+                sorted(os.listdir(tmp)),
+                ["p1.json", "p1.opt.json", "p2.json", "p2.opt.json"],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
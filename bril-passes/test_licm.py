@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+
+"""
+Regression checks of LICM, on loops in and out of SSA form. Run with
+`python -m unittest test_licm` from this directory.
+"""
+
+import unittest
+
+
+def const(dest, value):
+    return dict(op="const", dest=dest, type="int", value=value)
+
+
+def op(name, dest, *args, type_="int"):
+    return dict(op=name, dest=dest, type=type_, args=list(args))
+
+
+def fn(instrs, *args):
+    return dict(
+        functions=[
+            dict(
+                name="main",
+                args=[dict(name=arg, type="int") for arg in args],
+                instrs=instrs,
+            )
+        ]
+    )
+
+
+# Nested loops: `xx` is hoisted out of both, `q` may fault and stays.
+NESTED = fn(
+    [
+        const("i", 0),
+        const("n", 4),
+        const("one", 1),
+        const("s", 0),
+        const("v", 7),
+        dict(label="outer"),
+        dict(op="print", args=["v"]),
+        op("lt", "c", "i", "n", type_="bool"),
+        dict(op="br", args=["c"], labels=["obody", "done"]),
+        dict(label="obody"),
+        const("j", 0),
+        dict(label="inner"),
+        op("lt", "d", "j", "n", type_="bool"),
+        dict(op="br", args=["d"], labels=["ibody", "iend"]),
+        dict(label="ibody"),
+        op("mul", "xx", "x", "x"),
+        op("add", "k", "xx", "n"),
+        op("add", "s", "s", "k"),
+        op("gt", "e", "s", "n", type_="bool"),
+        dict(op="br", args=["e"], labels=["skip", "setv"]),
+        dict(label="setv"),
+        const("v", 3),
+        dict(label="skip"),
+        op("div", "q", "x", "n"),
+        op("add", "j", "j", "one"),
+        dict(op="jmp", labels=["inner"]),
+        dict(label="iend"),
+        op("add", "i", "i", "one"),
+        dict(op="jmp", labels=["outer"]),
+        dict(label="done"),
+        dict(op="print", args=["s", "v", "q", "k"]),
+    ],
+    "x",
+)
+
+# The header of the loop is the entry block.
+ENTRY_HEADER = fn(
+    [
+        dict(label="loop"),
+        const("one", 1),
+        const("zero", 0),
+        op("mul", "k0", "x", "x"),
+        op("sub", "n", "n", "one"),
+        dict(op="print", args=["k0", "n"]),
+        op("gt", "c", "n", "zero", type_="bool"),
+        dict(op="br", args=["c"], labels=["loop", "done"]),
+        dict(label="done"),
+        dict(op="print", args=["k0"]),
+    ],
+    "x",
+    "n",
+)
+
+# The loop is entered from two blocks defining `s` differently.
+TWO_ENTRIES = fn(
+    [
+        const("i", 0),
+        const("n", 3),
+        const("one", 1),
+        op("lt", "c0", "x", "n", type_="bool"),
+        dict(op="br", args=["c0"], labels=["a", "b"]),
+        dict(label="a"),
+        const("s", 1),
+        dict(op="jmp", labels=["head"]),
+        dict(label="b"),
+        const("s", 2),
+        dict(label="head"),
+        op("mul", "k", "x", "x"),
+        op("add", "s", "s", "k"),
+        op("add", "i", "i", "one"),
+        op("lt", "c", "i", "n", type_="bool"),
+        dict(op="br", args=["c"], labels=["head", "done"]),
+        dict(label="done"),
+        dict(op="print", args=["s"]),
+    ],
+    "x",
+)
+
+
+class TestLICM(unittest.TestCase):
+    def check(self, prg, passes, args):
+        """
+        Runs `prg` before and after `passes`, checking that it prints the
+        same, and that LICM saved instructions over the same passes without
+        it.
+        """
+        from io import StringIO
+        import json
+        from interp import run_prg
+        from opt import opt_prg
+
+        base = opt_prg(json.loads(json.dumps(prg)), [p for p in passes if p != "licm"])
+        opt = opt_prg(json.loads(json.dumps(prg)), passes)
+        out, opt_out = StringIO(), StringIO()
+        run_prg(prg, args, out)
+        count = run_prg(base, args, StringIO())
+        opt_count = run_prg(opt, args, opt_out)
+        self.assertEqual(opt_out.getvalue(), out.getvalue())
+        self.assertLess(opt_count, count)
+        return
+
+    def test_nested(self):
+        self.check(NESTED, ["licm"], ["3"])
+        self.check(NESTED, ["to-ssa", "licm", "from-ssa"], ["3"])
+
+    def test_entry_header(self):
+        self.check(ENTRY_HEADER, ["licm"], ["3", "4"])
+        self.check(ENTRY_HEADER, ["to-ssa", "licm", "from-ssa"], ["3", "4"])
+
+    def test_two_entries(self):
+        for x in ("1", "5"):
+            self.check(TWO_ENTRIES, ["licm"], [x])
+            self.check(TWO_ENTRIES, ["to-ssa", "licm", "from-ssa"], [x])
+
+    def test_then_gvn(self):
+        """
+        GVN out of SSA form does not undo what LICM saved with its copies.
+        """
+        from io import StringIO
+        import json
+        from interp import run_prg
+        from opt import opt_prg
+
+        for prg, args in ((NESTED, ["3"]), (TWO_ENTRIES, ["5"])):
+            licm = opt_prg(json.loads(json.dumps(prg)), ["licm"])
+            gvn = opt_prg(json.loads(json.dumps(prg)), ["licm", "gvn"])
+            count = run_prg(licm, args, StringIO())
+            self.assertLessEqual(run_prg(gvn, args, StringIO()), count)
+
+
+if __name__ == "__main__":
+    unittest.main()
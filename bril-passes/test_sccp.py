@@ -0,0 +1,54 @@
+#! /usr/bin/env python3
+
+"""
+Regression checks of SCCP and constant folding. Run with `python -m
+unittest test_sccp` from this directory.
+"""
+
+import unittest
+from test_licm import const, op, fn
+
+# `big * big` overflows 64 bits, in a loop so that SCCP carries it across
+# blocks before writing it back.
+OVERFLOW = fn(
+    [
+        const("i", 0),
+        const("n", 3),
+        const("one", 1),
+        const("big", 3037000500),
+        const("p", 0),
+        dict(label="loop"),
+        op("lt", "c", "i", "n", type_="bool"),
+        dict(op="br", args=["c"], labels=["body", "done"]),
+        dict(label="body"),
+        op("mul", "p", "big", "big"),
+        op("add", "q", "p", "p"),
+        op("add", "i", "i", "one"),
+        dict(op="jmp", labels=["loop"]),
+        dict(label="done"),
+        dict(op="print", args=["p", "q"]),
+    ]
+)
+
+
+class TestSCCP(unittest.TestCase):
+    def test_overflow(self):
+        from io import StringIO
+        import json
+        from interp import INT_MIN, INT_MAX, run_prg
+        from opt import opt_prg
+
+        out = StringIO()
+        run_prg(OVERFLOW, (), out)
+        for passes in (["sccp"], ["cfold"], ["to-ssa", "sccp", "from-ssa"]):
+            opt = opt_prg(json.loads(json.dumps(OVERFLOW)), passes)
+            opt_out = StringIO()
+            run_prg(opt, (), opt_out)
+            self.assertEqual(opt_out.getvalue(), out.getvalue(), passes)
+            for instr in opt["functions"][0]["instrs"]:
+                if instr.get("op", None) == "const":
+                    self.assertTrue(INT_MIN <= instr["value"] <= INT_MAX, passes)
+
+
+if __name__ == "__main__":
+    unittest.main()
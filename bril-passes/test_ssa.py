@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+
+"""
+Regression checks of the conversions to and out of SSA form. Run with
+`python -m unittest test_ssa` from this directory.
+"""
+
+import unittest
+from test_licm import const, op, fn
+
+# Sum of the first `n` integers.
+LOOP = fn(
+    [
+        const("i", 0),
+        const("s", 0),
+        const("one", 1),
+        dict(label="loop"),
+        op("lt", "c", "i", "n", type_="bool"),
+        dict(op="br", args=["c"], labels=["body", "done"]),
+        dict(label="body"),
+        op("add", "s", "s", "i"),
+        op("add", "i", "i", "one"),
+        dict(op="jmp", labels=["loop"]),
+        dict(label="done"),
+        dict(op="print", args=["s"]),
+    ],
+    "n",
+)
+
+# `a` and `b` are swapped at every iteration: their `phi`s interfere.
+SWAP = fn(
+    [
+        const("a", 1),
+        const("b", 2),
+        const("i", 0),
+        const("one", 1),
+        dict(label="loop"),
+        op("id", "t", "a"),
+        op("id", "a", "b"),
+        op("id", "b", "t"),
+        op("add", "i", "i", "one"),
+        op("lt", "c", "i", "n", type_="bool"),
+        dict(op="br", args=["c"], labels=["loop", "done"]),
+        dict(label="done"),
+        dict(op="print", args=["a", "b"]),
+    ],
+    "n",
+)
+
+
+class TestSSA(unittest.TestCase):
+    def roundtrip(self, prg, args):
+        """
+        Runs `prg` before and after a round trip through SSA form, checking
+        that it prints the same. Returns both instruction counts.
+        """
+        from io import StringIO
+        import json
+        from interp import run_prg
+        from opt import opt_prg
+
+        opt = opt_prg(json.loads(json.dumps(prg)), ["to-ssa", "from-ssa"])
+        out, opt_out = StringIO(), StringIO()
+        count = run_prg(prg, args, out)
+        opt_count = run_prg(opt, args, opt_out)
+        self.assertEqual(opt_out.getvalue(), out.getvalue())
+        return count, opt_count
+
+    def test_loop(self):
+        count, opt_count = self.roundtrip(LOOP, ["10"])
+        self.assertLessEqual(opt_count, count)
+
+    def test_swap(self):
+        for n in ("1", "2", "5"):
+            self.roundtrip(SWAP, [n])
+
+
+if __name__ == "__main__":
+    unittest.main()
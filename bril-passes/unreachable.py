@@ -0,0 +1,38 @@
+#! /usr/bin/env python3
+
+import click
+from stats import count, stats_options
+
+
+def unreachable_fn(fn):
+    """
+    Removes the blocks that cannot be reached from the entry of the function.
+    """
+    count("unreachable.blocks", fn["cfg"].remove_unreachable())
+    return fn
+
+
+def unreachable_prg(prg, jobs=1, stats=None):
+    from functools import partial
+    from cfg import run_on_cfg
+    from utils import map_prg
+
+    fn_pass = partial(run_on_cfg, unreachable_fn)
+    return map_prg(fn_pass, prg, jobs=jobs, stats=stats, name="unreachable")
+
+
+@click.command()
+@click.option("--jobs", default=1, help="Processes optimizing functions in parallel.")
+@stats_options
+def main(jobs, stats):
+    from utils import load_prg, dump_prg, is_binary_input
+
+    binary = is_binary_input()
+    prg = load_prg()
+    prg = unreachable_prg(prg, jobs=jobs, stats=stats)
+    dump_prg(prg, binary)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ from enum import Enum, auto
 from typing import Sequence
 
 OPS_THAT_COMMUTE = ("mul", "add", "and", "or")
+OPS_WITH_SIDE_EFFECTS = ("call", "alloc", "load")
+# Functions are sent to worker processes in chunks of at least this many
+# instructions, so that tiny functions do not pay one round trip each.
+CHUNK_INSTRS = 4096
 
 
 class InstrType(Enum):
@@ -15,10 +19,228 @@ class InstrType(Enum):
     CTRL = auto()
 
 
+def is_binary_input(file=None):
+    """
+    Whether the text file `file` (stdin by default) holds a program in
+    binary (see `binfmt`), looking at its first bytes without consuming
+    them.
+    """
+    from binfmt import is_binary
+
+    buffer = getattr(sys.stdin if file is None else file, "buffer", None)
+    return buffer is not None and hasattr(buffer, "peek") and is_binary(buffer.peek(4))
+
+
 def load_prg():
+    """
+    Reads the program on stdin, in JSON or in binary (see `is_binary_input`).
+    Binary programs are mapped in memory and their functions decoded as they
+    are accessed (see `binfmt.BinFns`).
+    """
+    if is_binary_input():
+        from binfmt import read_prg
+
+        return read_prg(sys.stdin.buffer)
     return json.loads(sys.stdin.read())
 
 
+def dump_prg(prg, binary=False):
+    """
+    Writes `prg` on stdout, in binary if `binary` is set.
+    """
+    if binary:
+        from binfmt import write_prg
+
+        sys.stdout.flush()
+        write_prg(prg, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        return
+    json.dump(prg, sys.stdout)
+    sys.stdout.write("\n")
+
+
+class PrgReader:
+    """
+    Incremental reader of a JSON program: values are decoded one at a time,
+    reading only as much of the input as they need.
+    """
+
+    def __init__(self, file, chunk_size=1 << 16):
+        self.file = file
+        self.chunk_size: int = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf: str = ""
+        self.pos: int = 0
+        self.eof: bool = False
+        return
+
+    def fill(self):
+        # Reading at least as much as what is pending keeps the retries on a
+        # large value linear overall.
+        data = self.file.read(max(self.chunk_size, len(self.buf) - self.pos))
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        self.eof = len(data) == 0
+        return
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise ValueError("Unexpected end of program.")
+            self.fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at '{self.buf[self.pos :][:20]}'.")
+        self.pos += 1
+        return
+
+    def accept(self, char):
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number is only complete once followed by a delimiter.
+                if self.eof or (end < len(self.buf) and self.buf[end] in ",:]} \t\n\r"):
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def chunk_fns(fns, chunk_instrs=CHUNK_INSTRS):
+    chunk, size = [], 0
+    for fn in fns:
+        chunk.append(fn)
+        size += len(fn.get("instrs", []))
+        if size >= chunk_instrs:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def run_chunk(fn_pass, chunk):
+    return [fn_pass(fn) for fn in chunk]
+
+
+def map_fns(fn_pass, fns, jobs=1):
+    """
+    Yields `fn_pass(fn)` for each function of `fns`, in order. With more
+    than one job, the functions are chunked by size and distributed over a
+    pool of processes, so `fn_pass` must be picklable (a module-level
+    function or a `functools.partial` of one). Only a few chunks per worker
+    are in flight at any time, so `fns` can be a stream.
+    """
+    if jobs <= 1:
+        yield from map(fn_pass, fns)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for chunk in chunk_fns(fns):
+            pending.append(pool.submit(run_chunk, fn_pass, chunk))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def run_fns(fn_pass, fns, jobs=1, stats=None, name=None, cache=None):
+    """
+    Same as `map_fns`, recording the stats of each function, timed as the
+    pass `name`, if `stats` is given, and only running `fn_pass` on the
+    functions missing from `cache` if given (see `cache.FnCache`).
+    """
+    if cache is not None:
+        return cache.map_fns(fn_pass, fns, jobs=jobs, stats=stats, name=name)
+    if stats is not None:
+        return stats.map_fns(fn_pass, fns, jobs, name)
+    return map_fns(fn_pass, fns, jobs)
+
+
+def map_prg(fn_pass, prg, jobs=1, stats=None, name=None, cache=None):
+    """
+    Runs `fn_pass` on every function of `prg` (see `run_fns`).
+    """
+    prg["functions"] = list(
+        run_fns(fn_pass, prg["functions"], jobs, stats, name, cache)
+    )
+    return prg
+
+
+def iter_fns(reader):
+    reader.expect("[")
+    first = True
+    while not reader.accept("]"):
+        if not first:
+            reader.expect(",")
+        first = False
+        yield reader.decode()
+
+
+def stream_prg(fn_pass, infile=None, outfile=None, jobs=1, stats=None, cache=None):
+    """
+    Runs `fn_pass` on the functions of the program in `infile` one at a
+    time, writing each result to `outfile` before reading the next function
+    (see `run_fns` for `jobs`, `stats` and `cache`).
+    Memory is bounded by the largest function rather than by the program.
+    The output is the same as `dump_prg` on the whole optimized program,
+    in binary if the input is (see `binfmt`).
+    """
+    infile = infile or sys.stdin
+    out = outfile or sys.stdout
+    if is_binary_input(infile):
+        from binfmt import read_prg, write_prg
+
+        prg = read_prg(infile.buffer)
+        prg["functions"] = run_fns(fn_pass, prg["functions"], jobs, stats, cache=cache)
+        out.flush()
+        write_prg(prg, out.buffer)
+        out.buffer.flush()
+        return
+    reader = PrgReader(infile)
+
+    reader.expect("{")
+    out.write("{")
+    first = True
+    while not reader.accept("}"):
+        if not first:
+            reader.expect(",")
+            out.write(", ")
+        first = False
+        key = reader.decode()
+        reader.expect(":")
+        out.write(f"{json.dumps(key)}: ")
+        if key != "functions":
+            out.write(json.dumps(reader.decode()))
+            continue
+        out.write("[")
+        fns = run_fns(fn_pass, iter_fns(reader), jobs, stats, cache=cache)
+        for i, fn in enumerate(fns):
+            if i > 0:
+                out.write(", ")
+            out.write(json.dumps(fn))
+        out.write("]")
+    out.write("}\n")
+    return
+
+
 def get_instr_type(instr):
     if "label" in instr:
         return InstrType.LABEL
@@ -35,5 +257,11 @@ def commutes(instr):
     return instr.get("op", None) in OPS_THAT_COMMUTE
 
 
+def has_side_effects(instr):
+    return instr.get("op", None) in OPS_WITH_SIDE_EFFECTS
+
+
 def is_sequence_but_not_string(x):
+    if isinstance(x, (list, tuple)):
+        return True
     return isinstance(x, Sequence) and (not isinstance(x, (str, bytes, bytearray)))